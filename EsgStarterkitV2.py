@@ -1,37 +1,19 @@
 import streamlit as st
-from openai import OpenAI
 import json
 import datetime
-import io
 import os
 import re
-import datetime
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, PageBreak, 
-    Table, TableStyle, Image, NextPageTemplate,
-    PageTemplate, Frame
-)
-from reportlab.lib.pagesizes import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus.tableofcontents import TableOfContents
-from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak, Image, Frame
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.enums import TA_CENTER
-import io
-import os
-from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, PageTemplate, Frame, PageBreak, Image, Paragraph, NextPageTemplate
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.pdfgen import canvas
+import threading
+import time
+import hashlib
+import importlib
+import sqlite3
+import uuid
+import random
+from contextlib import closing, contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 # Constants
 FIELDS_OF_INDUSTRY = [
     "Agriculture", "Forestry", "Fishing", "Mining and Quarrying",
@@ -54,6 +36,59 @@ ORGANIZATION_TYPES = [
     "Others"
 ]
 
+# ESG frameworks for various organization types
+ESG_FRAMEWORKS = {
+    "Public Listed Company": [
+        "Bursa Malaysia Sustainability Reporting Guide (3rd Edition)",
+        "Securities Commission Malaysia (SC): Malaysian Code on Corporate Governance (MCCG)",
+        "Global Reporting Initiative (GRI)",
+        "Task Force on Climate-related Financial Disclosures (TCFD)",
+        "Sustainability Accounting Standards Board (SASB)",
+        "GHG Protocol",
+        "ISO 14001",
+        "ISO 26000",
+    ],
+    "Financial Institution": [
+        "Bank Negara Malaysia (BNM) Climate Change and Principle-based Taxonomy (CCPT)",
+        "Malaysian Sustainable Finance Roadmap",
+        "Principles for Responsible Banking (PRB)",
+        "Task Force on Climate-related Financial Disclosures (TCFD)",
+        "Sustainability Accounting Standards Board (SASB)",
+        "GHG Protocol",
+        "ISO 14097",
+    ],
+    "SME/Enterprise": [
+        "Simplified ESG Disclosure Guide (SEDG)",
+        "Bursa Malaysia's Basic Sustainability Guidelines for SMEs",
+        "ISO 14001",
+        "Global Reporting Initiative (GRI)",
+        "GHG Protocol",
+        "ISO 26000",
+        "Sustainability Accounting Standards Board (SASB)",
+    ],
+    "Government Agency": [
+        "Malaysian Code on Corporate Governance (MCCG)",
+        "United Nations Sustainable Development Goals (SDGs)",
+        "International Public Sector Accounting Standards (IPSAS)",
+        "ISO 26000",
+        "GHG Protocol",
+    ],
+    "NGO": [
+        "Global Reporting Initiative (GRI)",
+        "Social Value International (SVI)",
+        "ISO 26000",
+        "United Nations Sustainable Development Goals (SDGs)",
+        "GHG Protocol",
+    ],
+    "Others": [
+        "UN Principles for Responsible Management Education (PRME)",
+        "ISO 26000",
+        "Sustainability Development Goals (SDGs)",
+        "GHG Protocol",
+        "ISO 14001",
+    ],
+}
+
 ESG_READINESS_QUESTIONS = {
     "1. Have you started formal ESG initiatives within your organization?": [
         "No, we haven't started yet.",
@@ -92,1017 +127,1700 @@ ESG_READINESS_QUESTIONS = {
         "Regulatory complexity and compliance requirements."
     ]
 }
-class PDFWithTOC(SimpleDocTemplate):
-    def __init__(self, *args, **kwargs):
-        SimpleDocTemplate.__init__(self, *args, **kwargs)
-        self.page_numbers = {}
-        self.current_page = 1
-
-    def afterPage(self):
-        self.current_page += 1
-
-    def afterFlowable(self, flowable):
-        if isinstance(flowable, Paragraph):
-            style = flowable.style.name
-            if style == 'heading':
-                text = flowable.getPlainText()
-                self.page_numbers[text] = self.current_page
-
-def generate_pdf(esg_data, personal_info, toc_page_numbers):
-    buffer = io.BytesIO()
-    
-    doc = PDFWithTOC(
-        buffer,
-        pagesize=letter,
-        rightMargin=inch,
-        leftMargin=inch,
-        topMargin=1.5*inch,
-        bottomMargin=inch
-    )
-    
-    full_page_frame = Frame(
-        0, 0, letter[0], letter[1],
-        leftPadding=0, rightPadding=0,
-        topPadding=0, bottomPadding=0
-    )
-    
-    normal_frame = Frame(
-        doc.leftMargin,
-        doc.bottomMargin,
-        doc.width,
-        doc.height,
-        id='normal'
+# Completion cache: finished completions are stored on local disk, keyed by
+# a hash of the model, temperature and rendered prompt, so identical requests
+# survive lost sessions and are shared between users. Completions of an
+# offline backend (ESG_LLM_BACKEND) get keys of their own.
+CACHE_DIR = os.environ.get("ESG_CACHE_DIR", ".esg_cache")
+COMPLETION_CACHE_TTL = int(os.environ.get("ESG_COMPLETION_CACHE_TTL", 7 * 24 * 3600))  # seconds
+COMPLETION_CACHE_MAX_ENTRIES = int(os.environ.get("ESG_COMPLETION_CACHE_MAX_ENTRIES", 5000))
+
+def completion_cache_key(model, temperature, messages, max_tokens=None):
+    """Content hash identifying a completion request"""
+    request = {'model': model, 'temperature': temperature, 'messages': messages}
+    if max_tokens is not None:
+        request['max_tokens'] = max_tokens
+    if LLM_BACKEND != 'openai':
+        # Offline output must never be served once the real backend is back
+        request['backend'] = LLM_BACKEND
+    payload = json.dumps(request, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _open_completion_cache():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, "completions.sqlite"), timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS completions ("
+        "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+        "created REAL NOT NULL, accessed REAL NOT NULL)"
     )
-    
-    disclaimer_frame = Frame(
-        doc.leftMargin,
-        doc.bottomMargin,
-        doc.width,
-        doc.height,
-        id='disclaimer'
+    return conn
+
+def completion_cache_get(key):
+    """Return the cached completion for key, or None if missing or expired"""
+    now = time.time()
+    with closing(_open_completion_cache()) as conn, conn:
+        row = conn.execute(
+            "SELECT content, created FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > COMPLETION_CACHE_TTL:
+            conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+def completion_cache_put(key, content):
+    """Store a completion and evict expired and least recently used entries"""
+    now = time.time()
+    with closing(_open_completion_cache()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO completions (key, content, created, accessed) "
+            "VALUES (?, ?, ?, ?)",
+            (key, content, now, now)
+        )
+        conn.execute("DELETE FROM completions WHERE created < ?", (now - COMPLETION_CACHE_TTL,))
+        conn.execute(
+            "DELETE FROM completions WHERE key IN ("
+            "SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (COMPLETION_CACHE_MAX_ENTRIES,)
+        )
+
+# Metrics: every stage of every report records its queue wait, wall time,
+# cache hit or miss and token usage (with the prompt tokens the provider read
+# from its prefix cache, as kind="cached"), and report jobs record their PDF
+# build.
+# Events are appended as JSON lines to ESG_METRICS_LOG and aggregated into a
+# Prometheus text file (ESG_METRICS_PROM_FILE), e.g. for node_exporter's
+# textfile collector. Both default to files in CACHE_DIR; ESG_METRICS=0
+# turns recording off.
+METRICS_ENABLED = os.environ.get("ESG_METRICS", "1") != "0"
+METRICS_LOG = os.environ.get("ESG_METRICS_LOG")  # default: CACHE_DIR/metrics.jsonl
+METRICS_PROM_FILE = os.environ.get("ESG_METRICS_PROM_FILE")  # default: CACHE_DIR/metrics.prom
+METRICS_SECONDS_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300]
+
+# Stage metrics of the pipeline stage running in the current thread
+_stage_metrics = threading.local()
+
+@st.cache_resource
+def _metrics_registry():
+    """Process-wide metric aggregates, kept across Streamlit reruns"""
+    return {'lock': threading.Lock(), 'counters': {}, 'histograms': {}}
+
+def _observe(registry, name, labels, value):
+    buckets, total = registry['histograms'].setdefault(
+        (name, labels), [[0] * len(METRICS_SECONDS_BUCKETS), [0.0, 0]]
     )
-    
-    templates = [
-        PageTemplate(id='First', frames=[full_page_frame],
-                    onPage=lambda canvas, doc: None),
-        PageTemplate(id='Later', frames=[normal_frame],
-                    onPage=create_header_footer),
-        PageTemplate(id='dis', frames=[normal_frame],
-                    onPage=create_header_footer_disclaimer)
-    ]
-    doc.addPageTemplates(templates)
-    
-    styles = create_custom_styles()
-    
-    # TOC style with right alignment for page numbers
-    toc_style = ParagraphStyle(
-        'TOCEntry',
-        parent=styles['normal'],
-        fontSize=12,
-        leading=20,
-        leftIndent=20,
-        rightIndent=30,
-        spaceBefore=10,
-        spaceAfter=10,
-        fontName='Helvetica'
+    for i, bound in enumerate(METRICS_SECONDS_BUCKETS):
+        if value <= bound:
+            buckets[i] += 1
+    total[0] += value
+    total[1] += 1
+
+def _count(registry, name, labels, value=1):
+    registry['counters'][(name, labels)] = registry['counters'].get((name, labels), 0) + value
+
+def _aggregate_metric(registry, event, fields):
+    stage = (('stage', fields.get('stage', '')),)
+    if event == 'stage':
+        _count(registry, 'esg_stages_total', stage + (('status', fields['status']),))
+        if fields['status'] == 'reused':
+            return
+        _observe(registry, 'esg_stage_queue_wait_seconds', stage, fields['queue_wait'])
+        _observe(registry, 'esg_stage_seconds', stage, fields['wall_time'])
+        if 'cache' in fields:
+            _count(registry, 'esg_completion_cache_total', stage + (('result', fields['cache']),))
+        for kind in ('prompt', 'completion', 'cached'):
+            if fields.get(f'{kind}_tokens') is not None:
+                _count(registry, 'esg_completion_tokens_total', stage + (('kind', kind),),
+                       fields[f'{kind}_tokens'])
+    elif event == 'report':
+        _count(registry, 'esg_reports_total', (('status', fields['status']),))
+        _observe(registry, 'esg_report_queue_wait_seconds', (), fields['queue_wait'])
+        _observe(registry, 'esg_report_seconds', (), fields['wall_time'])
+    elif event == 'pdf_build':
+        _observe(registry, 'esg_pdf_build_seconds', (), fields['seconds'])
+        _count(registry, 'esg_pdf_bytes_total', (), fields['bytes'])
+
+def _format_labels(labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+def _render_prometheus(registry):
+    """The aggregated metrics in the Prometheus text exposition format"""
+    lines = []
+    typed = set()
+    for (name, labels), value in sorted(registry['counters'].items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), (buckets, (total, count)) in sorted(registry['histograms'].items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        for bound, bucket in zip(METRICS_SECONDS_BUCKETS, buckets):
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {bucket}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+def record_metric(event, **fields):
+    """Record a metrics event ('stage', 'report' or 'pdf_build')"""
+    if not METRICS_ENABLED:
+        return
+    line = json.dumps({'ts': time.time(), 'event': event, **fields})
+    log_path = METRICS_LOG or os.path.join(CACHE_DIR, "metrics.jsonl")
+    prom_path = METRICS_PROM_FILE or os.path.join(CACHE_DIR, "metrics.prom")
+    registry = _metrics_registry()
+    with registry['lock']:
+        _aggregate_metric(registry, event, fields)
+        os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+        # Written to a temporary file first so scrapers never read a partial file
+        tmp_path = f"{prom_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(_render_prometheus(registry))
+        os.replace(tmp_path, prom_path)
+
+def _note_stage_metrics(**fields):
+    """Add fields to the metrics of the pipeline stage running in this thread, if any"""
+    metrics = getattr(_stage_metrics, 'current', None)
+    if metrics is not None:
+        metrics.update(fields)
+
+# Shared OpenAI clients: one client (and HTTP keep-alive pool) per API key,
+# reused across stages, users and Streamlit reruns. The openai package takes
+# longer to import than the rest of the page, so it is only imported when the
+# first client is created.
+OPENAI_MAX_CLIENTS = int(os.environ.get("ESG_OPENAI_MAX_CLIENTS", 64))
+OPENAI_CLIENT_IDLE_TTL = int(os.environ.get("ESG_OPENAI_CLIENT_IDLE_TTL", 600))  # seconds
+# Enough for every report job to run two stages at once
+OPENAI_POOL_MAX_CONNECTIONS = int(os.environ.get("ESG_OPENAI_POOL_MAX_CONNECTIONS", 100))
+OPENAI_POOL_KEEPALIVE_EXPIRY = 60  # seconds an idle connection stays open
+
+@st.cache_resource
+def _openai_client_registry():
+    """Process-wide client registry, kept across Streamlit reruns"""
+    return {'lock': threading.Lock(), 'clients': OrderedDict()}
+
+@contextmanager
+def openai_client(api_key):
+    """The shared OpenAI client for api_key, creating it if needed, for the with block.
+
+    Clients not in use by any with block are closed once idle for longer
+    than OPENAI_CLIENT_IDLE_TTL, and the least recently used idle client is
+    closed once OPENAI_MAX_CLIENTS is exceeded.
+    """
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+
+    registry = _openai_client_registry()
+    clients = registry['clients']
+    now = time.monotonic()
+    with registry['lock']:
+        for key, entry in list(clients.items()):
+            if key != api_key and not entry['users'] and now - entry['last_used'] > OPENAI_CLIENT_IDLE_TTL:
+                del clients[key]
+                entry['client'].close()
+
+        entry = clients.pop(api_key, None)
+        if entry is None:
+            # Retries are handled by create_completion, which also rate limits them
+            client = OpenAI(
+                api_key=api_key,
+                timeout=COMPLETION_TIMEOUT,
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=httpx.Limits(
+                    max_connections=OPENAI_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_POOL_MAX_CONNECTIONS,
+                    keepalive_expiry=OPENAI_POOL_KEEPALIVE_EXPIRY
+                ))
+            )
+            entry = {'client': client, 'users': 0}
+        entry['users'] += 1
+        entry['last_used'] = now
+        clients[api_key] = entry
+
+        # Clients in use are kept even if that leaves more than OPENAI_MAX_CLIENTS
+        idle = [key for key, entry in clients.items() if not entry['users']]
+        for key in idle[:max(0, len(clients) - OPENAI_MAX_CLIENTS)]:
+            clients.pop(key)['client'].close()
+    try:
+        yield entry['client']
+    finally:
+        with registry['lock']:
+            entry['users'] -= 1
+            entry['last_used'] = time.monotonic()
+
+# Completion call policy: a timeout per request, retries with jittered
+# exponential backoff on rate limits, timeouts and server errors, and a token
+# bucket per API key that every session using the key draws from.
+COMPLETION_TIMEOUT = float(os.environ.get("ESG_COMPLETION_TIMEOUT", 120))  # seconds per request
+COMPLETION_MAX_RETRIES = int(os.environ.get("ESG_COMPLETION_MAX_RETRIES", 5))
+COMPLETION_BACKOFF_BASE = 1.0  # seconds, doubled on every retry
+COMPLETION_BACKOFF_MAX = 60.0
+OPENAI_REQUESTS_PER_MINUTE = float(os.environ.get("ESG_OPENAI_RPM", 60))  # per API key
+OPENAI_REQUEST_BURST = int(os.environ.get("ESG_OPENAI_BURST", 10))
+
+def retryable_errors():
+    """The API errors a completion is retried after"""
+    import httpx
+    import openai
+    return (
+        openai.APIConnectionError,  # includes timeouts
+        openai.RateLimitError,
+        openai.InternalServerError,
+        httpx.TransportError  # connection dropped while reading a stream
     )
-    styles['toc'] = toc_style
-    
-    elements = []
-    
-    # Cover page
-    elements.append(NextPageTemplate('First'))
-    if os.path.exists("frontemma.jpg"):
-        img = Image("frontemma.jpg", width=letter[0], height=letter[1])
-        elements.append(img)
-    
-    elements.append(NextPageTemplate('Later'))
-    elements.append(PageBreak())
-    elements.append(Paragraph("Table of Contents", styles['heading']))
-    
-    # Section data
-    section_data = [
-        ("ESG Initial Assessment", esg_data['analysis1']),
-        ("Framework Analysis", esg_data['analysis2']),
-        ("Management Issues", esg_data['management_questions']),
-        ("Implementation Challenges", esg_data['implementation_challenges']),
-        ("Advisory Plan", esg_data['advisory']),
-        ("SROI Analysis", esg_data['sroi'])
-    ]
-    
-    # Format TOC entries with dots and manual page numbers
-    def create_toc_entry(num, title, page_num):
-        title_with_num = f"{num}. {title}"
-        dots = '.' * (50 - len(title_with_num))
-        return f"{title_with_num} {dots} {page_num}"
-
-    # First add the static Executive Summary entry
-    static_entry = create_toc_entry(1, "Profile Analysis", 3)  # 3 is the page number
-    elements.append(Paragraph(static_entry, toc_style))
-
-    # Then continue with the dynamic entries, starting from number 2
-    for i, ((title, _), page_num) in enumerate(zip(section_data, toc_page_numbers), 2):
-        toc_entry = create_toc_entry(i, title, page_num)
-        elements.append(Paragraph(toc_entry, toc_style))
-    
-    elements.append(PageBreak())
-    
-    # Content pages
-    elements.extend(create_second_page(styles, personal_info))
-    elements.append(PageBreak())
-    
-    # Main content
-    for i, (title, content) in enumerate(section_data):
-        elements.append(Paragraph(title, styles['heading']))
-        process_content(content, styles, elements)
-        if i < len(section_data) - 1:
-            elements.append(PageBreak())
-    
-    # Disclaimer
-    elements.append(NextPageTemplate('dis'))
-    elements.append(PageBreak())
-    create_disclaimer_page(styles, elements)
-    
-    # Back cover
-    elements.append(NextPageTemplate('First'))
-    elements.append(PageBreak())
-    if os.path.exists("backemma.png"):
-        img = Image("backemma.png", width=letter[0], height=letter[1])
-        elements.append(img)
-    
-    doc.build(elements, canvasmaker=NumberedCanvas)
-    buffer.seek(0)
-    return buffer
 
-class NumberedCanvas(canvas.Canvas):
-    def __init__(self, *args, **kwargs):
-        canvas.Canvas.__init__(self, *args, **kwargs)
-        self._saved_page_states = []
+class CompletionError(Exception):
+    """Raised when a completion cannot be generated"""
 
-    def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))
-        self._startPage()
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may be sent"""
+    def __init__(self, rate, capacity):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-    def save(self):
-        num_pages = len(self._saved_page_states)
-        for state in self._saved_page_states:
-            self.__dict__.update(state)
-            self.draw_page_number(num_pages)
-            canvas.Canvas.showPage(self)
-        canvas.Canvas.save(self)
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+                self.updated = max(self.updated, now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate + max(0.0, self.updated - now)
+            time.sleep(delay)
 
-    def draw_page_number(self, page_count):
-        if hasattr(self, '_pageNumber'):
-            self.setFont("Helvetica", 9)
+    def pause(self, seconds):
+        """Hold back every caller for `seconds`, e.g. after the API returned 429"""
+        with self.lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.monotonic() + seconds)
 
+@st.cache_resource
+def _rate_limiter_registry():
+    """Process-wide token buckets, kept across Streamlit reruns"""
+    return {'lock': threading.Lock(), 'buckets': {}}
 
+def get_rate_limiter(api_key):
+    """Return the token bucket shared by all calls made with api_key"""
+    registry = _rate_limiter_registry()
+    with registry['lock']:
+        bucket = registry['buckets'].get(api_key)
+        if bucket is None:
+            bucket = TokenBucket(OPENAI_REQUESTS_PER_MINUTE / 60, OPENAI_REQUEST_BURST)
+            registry['buckets'][api_key] = bucket
+    return bucket
 
-def create_disclaimer_page(styles, elements):
-    """Create a single-page disclaimer using Lato font family"""
-    
-    # Register Lato fonts
+def _retry_delay(attempt, error):
+    """Seconds to wait before retrying after `error` on attempt number `attempt` (from 0)"""
+    backoff = random.uniform(0, min(COMPLETION_BACKOFF_MAX, COMPLETION_BACKOFF_BASE * 2 ** attempt))
+    response = getattr(error, 'response', None)
     try:
-        pdfmetrics.registerFont(TTFont('Lato', 'fonts/Lato-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('Lato-Bold', 'fonts/Lato-Bold.ttf'))
-        base_font = 'Lato'
-        bold_font = 'Lato-Bold'
-    except:
-        # Fallback to Helvetica if Lato fonts are not available
-        base_font = 'Helvetica'
-        bold_font = 'Helvetica-Bold'
-    
-    # Define custom styles for the disclaimer page with Lato
-    disclaimer_styles = {
-        'title': ParagraphStyle(
-            'DisclaimerTitle',
-            parent=styles['normal'],
-            fontSize=24,
-            fontName=bold_font,
-            leading=28,
-            spaceBefore=0,
-            spaceAfter=10,
-        ),
-        'section_header': ParagraphStyle(
-            'SectionHeader',
-            parent=styles['normal'],
-            fontSize=10,
-            fontName=bold_font,
-            leading=13,
-            spaceBefore=2,
-            spaceAfter=3,
-        ),
-        'body_text': ParagraphStyle(
-            'BodyText',
-            parent=styles['normal'],
-            fontSize=8,
-            fontName=base_font,
-            leading=10,
-            spaceBefore=1,
-            spaceAfter=3,
-            alignment=TA_JUSTIFY,
-        ),
-        'item_header': ParagraphStyle(
-            'ItemHeader',
-            parent=styles['normal'],
-            fontSize=8,
-            fontName=bold_font,
-            leading=11,
-            spaceBefore=4,
-            spaceAfter=1,
-        ),
-        'confidential': ParagraphStyle(
-            'Confidential',
-            parent=styles['normal'],
-            fontSize=8,
-            fontName=base_font,
-            textColor=colors.black,
-            alignment=TA_CENTER,
-            spaceBefore=1,
-        )
-    }    
-    # Main Content
-    elements.append(Paragraph("Limitations of AI in Financial and Strategic Evaluations", 
-                            disclaimer_styles['section_header']))
-
-    # AI Limitations Section
-    limitations = [
-        ("1. Data Dependency and Quality",
-         "AI models rely heavily on the quality and completeness of the data fed into them. The accuracy of the analysis is contingent upon the integrity of the input data. Inaccurate, outdated, or incomplete data can lead to erroneous conclusions and recommendations. Users should ensure that the data used in AI evaluations is accurate and up-to-date."),
-        
-        ("2. Algorithmic Bias and Limitations",
-         "AI algorithms are designed based on historical data and predefined models. They may inadvertently incorporate biases present in the data, leading to skewed results. Additionally, AI models might not fully capture the complexity and nuances of human behavior or unexpected market changes, potentially impacting the reliability of the analysis."),
-        
-        ("3. Predictive Limitations",
-         "While AI can identify patterns and trends, it cannot predict future events with certainty. Financial markets and business environments are influenced by numerous unpredictable factors such as geopolitical events, economic fluctuations, and technological advancements. AI's predictions are probabilistic and should not be construed as definitive forecasts."),
-        
-        ("4. Interpretation of Results",
-         "AI-generated reports and analyses require careful interpretation. The insights provided by AI tools are based on algorithms and statistical models, which may not always align with real-world scenarios. It is essential to involve human expertise in interpreting AI outputs and making informed decisions."),
-        
-        ("5. Compliance and Regulatory Considerations",
-         "The use of AI in financial evaluations and business strategy formulation must comply with relevant regulations and standards. Users should be aware of legal and regulatory requirements applicable to AI applications in their jurisdiction and ensure that their use of AI tools aligns with these requirements.")
-    ]
+        retry_after = float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return backoff
+    # Never retry before the server asks us to, but still spread the callers out
+    return min(retry_after, COMPLETION_BACKOFF_MAX) + backoff / 2
 
-    for title, content in limitations:
-        elements.append(Paragraph(title, disclaimer_styles['item_header']))
-        elements.append(Paragraph(content, disclaimer_styles['body_text']))
+# Single-flight: concurrent identical requests (same cache key), e.g. from a
+# double click or several sessions submitting the same profile, share the
+# one call in flight instead of each calling the API.
+class InFlightCompletion:
+    """A completion being generated, shared by every caller asking for it meanwhile"""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.text = None  # Streamed so far
+        self.done = False
+        self.content = None
+        self.error = None
 
-    # RAA Capital Partners Section
-    elements.append(Paragraph("RAA Capital Partners Sdn Bhd and Advisory Partners' Disclaimer",
-                            disclaimer_styles['section_header']))
+    def publish(self, text):
+        with self.condition:
+            self.text = text
+            self.condition.notify_all()
 
-    elements.append(Paragraph(
-        "RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners provide AI-generated reports and insights as a tool to assist in financial and business strategy evaluations. However, the use of these AI-generated analyses is subject to the following disclaimers:",
-        disclaimer_styles['body_text']
-    ))
+    def finish(self, content=None, error=None):
+        with self.condition:
+            self.done = True
+            self.content = content
+            self.error = error
+            self.condition.notify_all()
 
-    disclaimers = [
-        ("1. No Guarantee of Accuracy or Completeness",
-         "While RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners strive to ensure that the AI-generated reports and insights are accurate and reliable, we do not guarantee the completeness or accuracy of the information provided. The insights are based on the data and models used, which may not fully account for all relevant factors or changes in the market."),
-        
-        ("2. Not Financial or Professional Advice",
-         "The AI-generated reports and insights are not intended as financial, investment, legal, or professional advice. Users should consult with qualified professionals before making any financial or strategic decisions based on AI-generated reports. RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners are not responsible for any decisions made based on the reports provided."),
-        
-        ("3. Limitation of Liability",
-         "RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners shall not be liable for any loss or damage arising from the use of AI-generated reports and insights. This includes, but is not limited to, any direct, indirect, incidental, or consequential damages resulting from reliance on the reports or decisions made based on them."),
-        
-        ("4. No Endorsement of Third-Party Tools",
-         "The use of third-party tools and data sources in AI evaluations is at the user's discretion. RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners do not endorse or guarantee the performance or accuracy of any third-party tools or data sources used in conjunction with the AI-generated reports.")
-    ]
+    def wait(self, on_text=None):
+        """Wait for the result, passing streamed text to on_text.
+
+        Returns None if the call was abandoned for a reason other than a
+        CompletionError, so the caller can make the call itself.
+        """
+        seen = None
+        while True:
+            with self.condition:
+                while not self.done and self.text is seen:
+                    self.condition.wait()
+                done, seen = self.done, self.text
+            if done:
+                break
+            if on_text is not None:
+                on_text(seen)
+        if isinstance(self.error, CompletionError):
+            raise CompletionError(str(self.error)) from self.error
+        if self.content is not None and on_text is not None:
+            on_text(self.content)
+        return self.content
+
+@st.cache_resource
+def _inflight_registry():
+    """Process-wide in-flight completions by cache key, kept across Streamlit reruns"""
+    return {'lock': threading.Lock(), 'calls': {}}
+
+def _join_inflight_completion(key):
+    """Return (call, leader): the call in flight for key, and whether this caller must make it"""
+    registry = _inflight_registry()
+    with registry['lock']:
+        call = registry['calls'].get(key)
+        if call is not None:
+            return call, False
+        call = registry['calls'][key] = InFlightCompletion()
+        return call, True
+
+def _leave_inflight_completion(key):
+    registry = _inflight_registry()
+    with registry['lock']:
+        registry['calls'].pop(key, None)
+
+def create_completion(api_key, prompt, model, temperature=0.7, stage=None, on_text=None,
+                      json_mode=False, refresh=False, max_tokens=None, fallback_model=None,
+                      fallback_after=None, system=None):
+    """Shared chat completion call used by every generator.
+
+    Results are served from the completion cache when available, otherwise
+    from the backend selected by ESG_LLM_BACKEND. `stage` names the
+    pipeline stage making the call. When `on_text` is given the
+    completion is streamed and `on_text` is called with the text received
+    so far as each chunk arrives; a retried stream starts over. With
+    `json_mode` the model is asked for a JSON object (the prompt must say
+    which). `refresh` skips the cache lookup; the new result replaces the
+    cached one. `max_tokens` caps the length of the completion, and
+    `fallback_model` is used instead of `model` if that is rate limited or
+    has not answered within `fallback_after` seconds; answers from the
+    fallback are not cached. `system` is sent as
+    a system message ahead of the prompt; keeping it fixed lets the provider
+    serve it from its prompt prefix cache.
+
+    Identical requests made while one is in flight wait for it and share
+    its result instead of calling the backend again.
+
+    Raises CompletionError if no completion could be generated.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    if system is not None:
+        messages.insert(0, {"role": "system", "content": system})
+    key = completion_cache_key(model, temperature, messages, max_tokens)
+    while True:
+        cached = None if refresh else completion_cache_get(key)
+        if cached is not None:
+            _note_stage_metrics(model=model, cache='hit')
+            if on_text is not None:
+                on_text(cached)
+            return cached
+
+        call, leader = _join_inflight_completion(key)
+        if leader:
+            break
+        content = call.wait(on_text)
+        if content is not None:
+            _note_stage_metrics(model=model, cache='coalesced')
+            return content
+        # The shared call was abandoned, e.g. its Streamlit run was stopped
+
+    def publish(text):
+        call.publish(text)
+        on_text(text)
 
-    for title, content in disclaimers:
-        elements.append(Paragraph(title, disclaimer_styles['item_header']))
-        elements.append(Paragraph(content, disclaimer_styles['body_text']))
-
-    # Add bottom line
-    elements.append(Table(
-        [['']],
-        colWidths=[7.5*inch],
-        style=TableStyle([
-            ('LINEABOVE', (0,0), (-1,0), 1, colors.black),
-        ])
-    ))
-
-    # Add "strictly confidential"
-    elements.append(Paragraph("strictly confidential", disclaimer_styles['confidential']))
-def clean_text(text):
-    if not text:
-        return ""
-    text = re.sub(r'#{1,6}\s?', '', text)  # Remove markdown headers
-    text = re.sub(r'[\*_`]', '', text)      # Remove markdown formatting
-    text = re.sub(r'\.{2,}', '.', text)     # Clean up multiple periods
-    return ' '.join(text.split()).strip()
-def create_highlight_box(text, styles):
-    """Create highlighted box with consistent styling"""
-    return Table(
-        [[Paragraph(f"• {text}", styles['content'])]],
-        colWidths=[6*inch],
-        style=TableStyle([
-            ('BACKGROUND', (0,0), (-1,-1), colors.HexColor('#F7FAFC')),
-            ('BORDER', (0,0), (-1,-1), 1, colors.HexColor('#90CDF4')),
-            ('PADDING', (0,0), (-1,-1), 12),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ])
-    )
-def create_second_page(styles, org_info):
-    """Create an enhanced front page with modern design elements"""
-    elements = []
-    
-    # Add some space at the top
-    elements.append(Spacer(1, 1*inch))
-    
-    # Create a colored banner for the title
-    title_table = Table(
-        [[Paragraph("Profile Analysis", styles['title'])]],
-        colWidths=[7*inch],
-        style=TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F0F9FF')),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('TOPPADDING', (0, 0), (-1, -1), 30),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 30),
-            ('LEFTPADDING', (0, 0), (-1, -1), 20),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 20),
-            ('LINEABOVE', (0, 0), (-1, 0), 2, colors.HexColor('#2B6CB0')),
-            ('LINEBELOW', (0, 0), (-1, 0), 2, colors.HexColor('#2B6CB0')),
-        ])
-    )
-    elements.append(title_table)
-    
-    # Add space before organization info
-    elements.append(Spacer(1, 1*inch))
-    
-    # Create a styled box for organization info
-    org_info_content = [
-        [Paragraph("Organization Profile", styles['subheading'])],
-        [Table(
-            [
-                [
-                    Paragraph("Organization Type", 
-                             ParagraphStyle('Label', parent=styles['content'], textColor=colors.HexColor('#2B6CB0'), fontSize=12)),
-                    Paragraph(str(org_info.get('type', 'N/A')), styles['content'])
-                ],
-                [
-                    Paragraph("Industry Sector",
-                             ParagraphStyle('Label', parent=styles['content'], textColor=colors.HexColor('#2B6CB0'), fontSize=12)),
-                    Paragraph(str(org_info.get('sector', 'N/A')), styles['content'])  # Make sure we're using 'sector' here
-                ],
-                [
-                    Paragraph("Report Date",
-                             ParagraphStyle('Label', parent=styles['content'], textColor=colors.HexColor('#2B6CB0'), fontSize=12)),
-                    Paragraph(str(org_info.get('date', 'N/A')), styles['content'])
-                ]
-            ],
-            colWidths=[2*inch, 4*inch],
-            style=TableStyle([
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E2E8F0')),
-                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F7FAFC')),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('TOPPADDING', (0, 0), (-1, -1), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-                ('LEFTPADDING', (0, 0), (-1, -1), 15),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-            ])
-        )]
-    ]
-    
-    info_table = Table(
-        org_info_content,
-        colWidths=[7*inch],
-        style=TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#90CDF4')),
-            ('TOPPADDING', (0, 0), (-1, -1), 20),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 20),
-            ('LEFTPADDING', (0, 0), (-1, -1), 30),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 30),
-        ])
-    )
-    elements.append(info_table)
-    
-    # Add decorative footer
-    elements.append(Spacer(1, 1*inch))
-    footer_text = ParagraphStyle(
-        'Footer',
-        parent=styles['content'],
-        alignment=TA_CENTER,
-        textColor=colors.HexColor('#4A5568'),
-        fontSize=9
-    )
-    elements.append(Paragraph(
-        "Prepared by Centre for AI Innovation (CEAI)",
-        footer_text
-    ))
-    elements.append(Paragraph(
-        f"Generated on {org_info.get('date', 'N/A')}",
-        footer_text
-    ))
-    
-    return elements
-def create_custom_styles():
-    base_styles = getSampleStyleSheet()
-    
     try:
-        pdfmetrics.registerFont(TTFont('Lato', 'fonts/Lato-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('Lato-Bold', 'fonts/Lato-Bold.ttf'))
-        pdfmetrics.registerFont(TTFont('Lato-Italic', 'fonts/Lato-Italic.ttf'))
-        pdfmetrics.registerFont(TTFont('Lato-BoldItalic', 'fonts/Lato-BoldItalic.ttf'))
-        base_font = 'Lato'
-        bold_font = 'Lato-Bold'
-    except:
-        base_font = 'Helvetica'
-        bold_font = 'Helvetica-Bold'
-
-    styles = {
-        'Normal': base_styles['Normal'],
-        'TOCEntry': ParagraphStyle(
-            'TOCEntry',
-            parent=base_styles['Normal'],
-            fontSize=12,
-            leading=16,
-            leftIndent=20,
-            fontName=base_font
-        ),
-        'title': ParagraphStyle(
-            'CustomTitle',
-            parent=base_styles['Normal'],
-            fontSize=24,
-            textColor=colors.HexColor('#2B6CB0'),
-            alignment=TA_CENTER,
-            spaceAfter=30,
-            fontName=bold_font,
-            leading=28.8
-        ),
-        'heading': ParagraphStyle(
-            'CustomHeading',
-            parent=base_styles['Normal'],
-            fontSize=26,
-            textColor=colors.HexColor('#1a1a1a'),
-            spaceBefore=20,
-            spaceAfter=15,
-            fontName=bold_font,
-            leading=40.5,
-            tracking=0
-        ),
-        'subheading': ParagraphStyle(
-            'CustomSubheading',
-            parent=base_styles['Normal'],
-            fontSize=12,
-            textColor=colors.HexColor('#4A5568'),
-            spaceBefore=15,
-            spaceAfter=10,
-            fontName=bold_font,
-            leading=18.2
-        ),
-        'normal': ParagraphStyle(
-            'CustomNormal',
-            parent=base_styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#1a1a1a'),
-            spaceBefore=6,
-            spaceAfter=6,
-            fontName=base_font,
-            leading=15.4,
-            tracking=0
-        ),
-        'content': ParagraphStyle(
-            'CustomContent',
-            parent=base_styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#1a1a1a'),
-            alignment=TA_JUSTIFY,
-            spaceBefore=6,
-            spaceAfter=6,
-            fontName=base_font,
-            leading=15.4,
-            tracking=0
-        ),
-        'bullet': ParagraphStyle(
-            'CustomBullet',
-            parent=base_styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#1a1a1a'),
-            leftIndent=20,
-            firstLineIndent=0,
-            fontName=base_font,
-            leading=15.4,
-            tracking=0
+        backend = COMPLETION_BACKENDS[LLM_BACKEND]
+        start = time.perf_counter()
+        content, usage = backend(
+            api_key, model, messages, temperature, stage, None if on_text is None else publish,
+            json_mode, max_tokens=max_tokens, fallback_model=fallback_model,
+            fallback_after=fallback_after
         )
-    }
-    
-    return styles
-def scale_image_to_fit(image_path, max_width, max_height):
-    """Scale image to fit within maximum dimensions while maintaining aspect ratio."""
-    from PIL import Image as PILImage
-    import os
-    
-    if not os.path.exists(image_path):
-        return None
-        
-    try:
-        img = PILImage.open(image_path)
-        img_width, img_height = img.size
-        
-        # Calculate scaling factor
-        width_ratio = max_width / img_width
-        height_ratio = max_height / img_height
-        scale = min(width_ratio, height_ratio)
-        
-        new_width = img_width * scale
-        new_height = img_height * scale
-        
-        return new_width, new_height
-    except Exception as e:
-        print(f"Error scaling image: {str(e)}")
-        return None
+        served_model = (usage or {}).get('model', model)
+        _note_stage_metrics(
+            model=served_model, cache='miss', api_time=time.perf_counter() - start,
+            prompt_tokens=usage and usage.get('prompt_tokens'),
+            completion_tokens=usage and usage.get('completion_tokens'),
+            cached_tokens=usage and usage.get('cached_tokens')
+        )
+        if not content:
+            raise CompletionError("The model returned an empty response")
+        # A fallback answer is not kept, so the next request tries the primary model again
+        if served_model == model:
+            completion_cache_put(key, content)
+    except BaseException as e:
+        call.finish(error=e)
+        raise
+    else:
+        call.finish(content)
+    finally:
+        _leave_inflight_completion(key)
+    return content
 
-def create_front_page(styles, org_info):
-    """Create a front page using a full-page cover image."""
-    elements = []
-    
-    if os.path.exists("frontemma.png"):
-        # Create full page image without margins
-        img = Image(
-            "frontemma.png",
-            width=letter[0],     # Full letter width (8.5 inches)
-            height=letter[1]     # Full letter height (11 inches)
+def openai_completion(api_key, model, messages, temperature, stage, on_text, json_mode=False,
+                      max_tokens=None, fallback_model=None, fallback_after=None):
+    """Completion backend calling the OpenAI API, with retries and per-key rate limiting"""
+    import openai
+
+    limiter = get_rate_limiter(api_key)
+    # Held for all attempts, so the client is not closed as idle in between
+    with openai_client(api_key) as client:
+        skip_limiter = False
+        for attempt in range(COMPLETION_MAX_RETRIES + 1):
+            if not skip_limiter:
+                limiter.acquire()
+            skip_limiter = False
+            can_fall_back = fallback_model and model != fallback_model
+            try:
+                content, usage = _request_completion(
+                    client, model, messages, temperature, on_text, json_mode, max_tokens,
+                    # With a fallback the primary model gets less than COMPLETION_TIMEOUT
+                    fallback_after if can_fall_back else None
+                )
+                # Tells create_completion which model answered
+                return content, dict(usage or {}, model=model)
+            except retryable_errors() as e:
+                # An exhausted quota will not come back by waiting
+                if attempt == COMPLETION_MAX_RETRIES or getattr(e, 'code', None) == 'insufficient_quota':
+                    raise CompletionError(f"OpenAI request failed after {attempt + 1} attempts: {e}") from e
+                delay = _retry_delay(attempt, e)
+                if can_fall_back and isinstance(e, (openai.RateLimitError, openai.APITimeoutError)):
+                    if isinstance(e, openai.RateLimitError):
+                        # Other calls on the key still back off; this one goes to the
+                        # fallback model, which OpenAI rate limits separately
+                        limiter.pause(delay)
+                        skip_limiter = True
+                    model = fallback_model
+                    continue
+                if isinstance(e, openai.RateLimitError):
+                    limiter.pause(delay)
+                time.sleep(delay)
+            except openai.OpenAIError as e:
+                raise CompletionError(f"OpenAI request failed: {e}") from e
+
+def _request_completion(client, model, messages, temperature, on_text, json_mode, max_tokens,
+                        timeout=None):
+    options = {'response_format': {"type": "json_object"}} if json_mode else {}
+    if max_tokens is not None:
+        options['max_tokens'] = max_tokens
+    if timeout is not None:
+        options['timeout'] = timeout
+    if on_text is None:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **options
         )
-        elements.append(img)
+        content = response.choices[0].message.content
+        usage = response.usage
     else:
-        # Fallback content if image is missing
-        elements.extend([
-            Spacer(1, 2*inch),
-            Paragraph("ESG Assessment Report", styles['title']),
-            Spacer(1, 1*inch),
-            Paragraph(f"Organization: {org_info['organization_name']}", styles['content']),
-            Paragraph(f"Date: {org_info['date']}", styles['content'])
-        ])
-    
-    return elements
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options
+        )
+        content = ""
+        usage = None
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                content += chunk.choices[0].delta.content
+                on_text(content)
+            if chunk.usage:
+                # Sent in a final chunk without choices
+                usage = chunk.usage
+    if usage is not None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        usage = {
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            # Prompt tokens served from the provider's prefix cache
+            'cached_tokens': details and details.cached_tokens
+        }
+    return content, usage
 
+# Offline completion backend: deterministic markdown returned after a
+# simulated delay, for benchmarks and working without network or API key.
+# ESG_FAKE_LLM_FILE optionally names a JSON file of canned responses by stage.
+# Prompt prefix caching is simulated as OpenAI does it, so cached_tokens in
+# the stage metrics shows the hit rate a prompt layout would get.
+FAKE_LLM_LATENCY = float(os.environ.get("ESG_FAKE_LLM_LATENCY", 2.0))  # seconds per completion
+FAKE_LLM_WORDS = int(os.environ.get("ESG_FAKE_LLM_WORDS", 600))  # words per generated response
+FAKE_LLM_FILE = os.environ.get("ESG_FAKE_LLM_FILE")
+FAKE_LLM_STREAM_CHUNKS = 20
+FAKE_PREFIX_CACHE_MODELS = ("gpt-4o", "gpt-4.1", "o1", "o3", "o4")  # model name prefixes
+FAKE_PREFIX_CACHE_MIN_TOKENS = 1024
+FAKE_PREFIX_CACHE_STEP = 128  # tokens
+FAKE_PREFIX_CACHE_ENTRIES = 256
+FAKE_LLM_VOCABULARY = (
+    "sustainability governance emissions disclosure stakeholder materiality "
+    "framework reporting climate social value investment community supply "
+    "chain energy waste water biodiversity compliance board oversight risk "
+    "opportunity transition targets metrics assurance human rights training"
+).split()
 
-def process_content(content, styles, elements):
-    """Process content with proper formatting"""
-    if not content:
-        return
-    
-    paragraphs = content.strip().split('\n')
-    for para in paragraphs:
-        clean_para = clean_text(para)
-        if not clean_para:
-            continue
-        if "Summary" in clean_para:
-            elements.append(Paragraph(clean_para, styles['subheading']))  # Add as a subheading
-            continue
-        if "Strengths and Advantages" in clean_para:
-            elements.append(Paragraph(clean_para, styles['subheading']))  # Add as a subheading
-            continue
-        if "Skills and Competencies" in clean_para:
-            elements.append(Paragraph(clean_para, styles['subheading']))  # Add as a subheading
-            continue
+def fake_markdown(words, seed=0):
+    """Deterministic LLM-style markdown of roughly `words` words"""
+    rng = random.Random(seed)
+    lines = []
+    count = 0
+    section = 0
+    while count < words:
+        section += 1
+        lines.append(f"## Section {section}: {rng.choice(FAKE_LLM_VOCABULARY).title()}")
+        for _ in range(2):
+            sentence = ' '.join(rng.choice(FAKE_LLM_VOCABULARY) for _ in range(60))
+            lines.append(f"The **organization** should {sentence}.")
+            count += 63
+        for i in range(1, 4):
+            point = ' '.join(rng.choice(FAKE_LLM_VOCABULARY) for _ in range(20))
+            lines.append(f"{i}. **Priority {i}**: {point}.")
+            count += 22
+        lines.append(f"- {' '.join(rng.choice(FAKE_LLM_VOCABULARY) for _ in range(12))}")
+        count += 12
+        lines.append("")
+    return '\n'.join(lines)
 
-        if "Compatible Personality and Behavioral Insights" in clean_para:
-            elements.append(PageBreak())  # Add a page break
-            elements.append(Paragraph(clean_para, styles['subheading']))  # Add as a subheading
-            continue
-        
-        # Handle numbered points
-        point_match = re.match(r'^\d+\.?\s+(.+)', clean_para)
-        if point_match:
-            elements.extend([
-                Spacer(1, 0.1*inch),
-                create_highlight_box(point_match.group(1), styles),
-                Spacer(1, 0.1*inch)
-            ])
-        # Handle bullet points
-        elif clean_para.startswith(('•', '-', '*')):
-            elements.append(
-                Paragraph(
-                    f"• {clean_para.lstrip('•-* ')}",
-                    styles['bullet']
-                )
-            )
+@st.cache_data
+def _load_canned_responses(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def fake_structured(schema, words, seed=0):
+    """Deterministic JSON text matching a structured output schema, of roughly `words` words"""
+    rng = random.Random(seed)
+
+    def value(spec, length):
+        if spec is str:
+            text = ' '.join(rng.choice(FAKE_LLM_VOCABULARY) for _ in range(length)).capitalize()
+            return text + '.' if length > 4 else text
+        if spec is float:
+            return round(rng.uniform(1, 10), 2)
+        if isinstance(spec, list):
+            return [value(spec[0], length) for _ in range(3)]
+        return {
+            field: value(item, 4 if field in ('heading', 'title', 'label') else length)
+            for field, item in spec.items()
+        }
+
+    data = value({field: spec for field, spec in schema.items() if field != 'sections'}, 40)
+    data['sections'] = [value(schema['sections'][0], 40) for _ in range(max(1, words // 250))]
+    return json.dumps(data)
+
+@st.cache_resource
+def _fake_prefix_cache():
+    """Prompts recently sent to the fake backend, kept across Streamlit reruns"""
+    return {'lock': threading.Lock(), 'prompts': deque(maxlen=FAKE_PREFIX_CACHE_ENTRIES)}
+
+def _fake_cached_tokens(model, messages):
+    """Tokens of the prompt a provider prefix cache would have served"""
+    if not model.startswith(FAKE_PREFIX_CACHE_MODELS):
+        return 0
+    prompt = ''.join(f"{message['role']}\n{message['content']}\n" for message in messages)
+    cache = _fake_prefix_cache()
+    with cache['lock']:
+        shared = max(
+            (len(os.path.commonprefix([prompt, seen])) for seen_model, seen in cache['prompts']
+             if seen_model == model),
+            default=0
+        )
+        cache['prompts'].append((model, prompt))
+    tokens = shared // 4 // FAKE_PREFIX_CACHE_STEP * FAKE_PREFIX_CACHE_STEP
+    return tokens if tokens >= FAKE_PREFIX_CACHE_MIN_TOKENS else 0
+
+def fake_completion(api_key, model, messages, temperature, stage, on_text, json_mode=False,
+                    max_tokens=None, fallback_model=None, fallback_after=None):
+    """Offline completion backend: canned or generated text after FAKE_LLM_LATENCY seconds"""
+    canned = _load_canned_responses(FAKE_LLM_FILE) if FAKE_LLM_FILE else {}
+    # Seeded by the prompt, so the same prompt always gets the same response
+    seed = int(completion_cache_key(model, temperature, messages)[:16], 16)
+    words = FAKE_LLM_WORDS
+    if max_tokens is not None:
+        words = min(words, int(max_tokens / TOKENS_PER_WORD))
+    if stage in canned:
+        content = canned[stage]
+    elif json_mode:
+        content = fake_structured(STAGE_SCHEMAS[stage], words, seed)
+    else:
+        content = fake_markdown(words, seed)
+    # Rough token counts (about four characters per token)
+    usage = {
+        'prompt_tokens': sum(len(message['content']) for message in messages) // 4,
+        'completion_tokens': len(content) // 4,
+        'cached_tokens': _fake_cached_tokens(model, messages)
+    }
+    if on_text is None:
+        time.sleep(FAKE_LLM_LATENCY)
+        return content, usage
+    for i in range(1, FAKE_LLM_STREAM_CHUNKS + 1):
+        time.sleep(FAKE_LLM_LATENCY / FAKE_LLM_STREAM_CHUNKS)
+        on_text(content[:len(content) * i // FAKE_LLM_STREAM_CHUNKS])
+    return content, usage
+
+# Completion backend used by create_completion ("openai" or "fake"). A backend
+# returns (content, usage), usage being a dict of prompt_tokens and
+# completion_tokens (plus cached_tokens, the part of the prompt read from a
+# prefix cache, and model, if it may differ from the one asked for) or None
+# if unknown. With json_mode it must return a JSON object, and it should
+# stop after about max_tokens tokens.
+COMPLETION_BACKENDS = {
+    'openai': openai_completion,
+    'fake': fake_completion
+}
+LLM_BACKEND = os.environ.get("ESG_LLM_BACKEND", "openai")
+
+def stream_to(placeholder):
+    """Callback rendering streamed text into a Streamlit placeholder"""
+    return lambda text: placeholder.markdown(text + "▌")
+
+# Stage routing: the model, temperature and length of every completion. The
+# completion token limit follows from the stage's word target, with headroom
+# for markdown and a little overrun; JSON output needs more tokens for the
+# same text. The analyses the rest of the report builds on keep the larger
+# models; the stages that elaborate on them use a faster one. A stage whose
+# model is rate limited, or has not answered within its fallback_after
+# seconds, is retried on its fallback model. By default fallback_after
+# allows the stage's token limit at FALLBACK_MIN_TOKENS_PER_SECOND; when
+# streaming it bounds the wait for each chunk rather than the whole answer.
+# ESG_STAGE_ROUTING may hold a JSON object of per-stage overrides, e.g.
+# {"sroi": {"model": "gpt-4-turbo", "words": 900, "fallback_after": 60}}.
+TOKENS_PER_WORD = 1.4
+MAX_TOKENS_HEADROOM = 1.5
+STRUCTURED_TOKENS_FACTOR = 1.3
+FALLBACK_MODEL = "gpt-4o-mini"
+FALLBACK_MIN_TOKENS_PER_SECOND = 20
+FALLBACK_GRACE = 10  # seconds allowed on top, for reading the prompt
+STAGE_ROUTING = {
+    'analysis1': {'model': "gpt-4-turbo-preview", 'words': 535},
+    'analysis2': {'model': "gpt-4-turbo", 'words': 450},
+    'management_questions': {'model': "gpt-4-turbo-preview", 'words': 650},
+    'question_rationale': {'model': "gpt-4o", 'words': 680},
+    'implementation_challenges': {'model': "gpt-4o", 'words': 680},
+    'advisory': {'model': "gpt-4o", 'words': 480},
+    'sroi': {'model': "gpt-4o", 'words': 730},
+    'baseline': {'model': "gpt-4-turbo", 'words': 450},
+    'personalization': {'model': "gpt-4o", 'words': 200},
+}
+for _stage, _override in json.loads(os.environ.get("ESG_STAGE_ROUTING") or "{}").items():
+    STAGE_ROUTING.setdefault(_stage, {}).update(_override)
+
+def stage_route(stage, json_mode=False):
+    """create_completion arguments for a stage: model, temperature, length and fallback"""
+    route = STAGE_ROUTING[stage]
+    max_tokens = int(route['words'] * TOKENS_PER_WORD * MAX_TOKENS_HEADROOM
+                     * (STRUCTURED_TOKENS_FACTOR if json_mode else 1))
+    return {
+        'model': route['model'],
+        'temperature': route.get('temperature', 0.7),
+        'max_tokens': max_tokens,
+        'fallback_model': route.get('fallback', FALLBACK_MODEL),
+        'fallback_after': route.get(
+            'fallback_after', max_tokens / FALLBACK_MIN_TOKENS_PER_SECOND + FALLBACK_GRACE
+        )
+    }
+
+# Structured output: with ESG_OUTPUT_MODE=json every stage asks for a JSON
+# object matching its schema below instead of free-form markdown. Responses
+# are validated; an invalid one is sent once to ESG_REPAIR_MODEL to be fixed.
+# The stage result is then the validated JSON, reduced to the schema's
+# fields, and the UI, PDF and downstream prompts are built from its fields.
+OUTPUT_MODE = os.environ.get("ESG_OUTPUT_MODE", "markdown")  # "markdown" or "json"
+STRUCTURED_REPAIR_MODEL = os.environ.get("ESG_REPAIR_MODEL", "gpt-4o-mini")
+
+# A schema is a dict of field -> str, float, a nested schema, or a
+# one-item list of any of those for a list of values
+_SECTION_SCHEMA = {'heading': str, 'paragraphs': [str], 'points': [str]}
+_BASE_SCHEMA = {'summary': str, 'sections': [_SECTION_SCHEMA]}
+STAGE_SCHEMAS = {
+    'analysis1': _BASE_SCHEMA,
+    'analysis2': {**_BASE_SCHEMA, 'frameworks': [str]},
+    'management_questions': {**_BASE_SCHEMA, 'issues': [{'title': str, 'detail': str}]},
+    'question_rationale': _BASE_SCHEMA,
+    'implementation_challenges': _BASE_SCHEMA,
+    'advisory': _BASE_SCHEMA,
+    'sroi': {
+        **_BASE_SCHEMA,
+        'ratios': [{'label': str, 'investment_rm': float, 'social_value_rm': float, 'ratio': float}]
+    }
+}
+
+def _schema_example(schema):
+    if schema is str:
+        return "string"
+    if schema is float:
+        return 0
+    if isinstance(schema, list):
+        return [_schema_example(schema[0])]
+    return {field: _schema_example(spec) for field, spec in schema.items()}
+
+def structured_instructions(schema):
+    """Prompt text asking for a JSON object matching schema"""
+    return f"""
+
+Respond with a single JSON object and nothing else, in this shape:
+{json.dumps(_schema_example(schema), indent=2)}
+Use "sections" for the headers and their narrative paragraphs, "points" for
+numbered points, and plain numbers (no currency symbols or units) for
+numeric fields. Do not use markdown inside the strings."""
+
+def conform_to_schema(value, schema, path='$', errors=None):
+    """Check value against schema; returns (value reduced to the schema's fields, errors)"""
+    errors = [] if errors is None else errors
+    if schema is str:
+        if not isinstance(value, str):
+            errors.append(f"{path} should be a string")
+        return value, errors
+    if schema is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f"{path} should be a number")
+        return value, errors
+    if isinstance(schema, list):
+        if not isinstance(value, list):
+            errors.append(f"{path} should be a list")
+            return value, errors
+        return [conform_to_schema(item, schema[0], f"{path}[{i}]", errors)[0]
+                for i, item in enumerate(value)], errors
+    if not isinstance(value, dict):
+        errors.append(f"{path} should be an object")
+        return value, errors
+    conformed = {}
+    for field, spec in schema.items():
+        if field not in value:
+            errors.append(f"{path}.{field} is missing")
         else:
-            elements.append(Paragraph(clean_para, styles['content']))
-            elements.append(Spacer(1, 0.05*inch))
-def create_header_footer(canvas, doc):
-    """Add header and footer with smaller, transparent images in the top right and a line below the header."""
-    canvas.saveState()
-    
-    # Register Lato fonts if available
-    try:
-        pdfmetrics.registerFont(TTFont('Lato', 'fonts/Lato-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('Lato-Bold', 'fonts/Lato-Bold.ttf'))
-        base_font = 'Lato'
-        bold_font = 'Lato-Bold'
-    except:
-        # Fallback to Helvetica if Lato fonts are not available
-        base_font = 'Helvetica'
-        bold_font = 'Helvetica-Bold'
-    
-    if doc.page > 1:  # Only show on pages after the first page
-        # Adjust the position to the top right
-        x_start = doc.width + doc.leftMargin - 1.0 * inch  # Align closer to the right
-        y_position = doc.height + doc.topMargin - 0.1 * inch  # Slightly below the top margin
-        image_width = 0.5 * inch  # Smaller width
-        image_height = 0.5 * inch  # Smaller height
-
-        # Draw images (ensure they are saved with transparent backgrounds)
-        if os.path.exists("ceai.png"):
-            canvas.drawImage(
-                "ceai.png", 
-                x_start, 
-                y_position, 
-                width=image_width, 
-                height=image_height, 
-                mask="auto"
-            )
-        
-        if os.path.exists("raa.png"):
-            canvas.drawImage(
-                "raa.png", 
-                x_start - image_width - 0.1 * inch,
-                y_position, 
-                width=image_width, 
-                height=image_height, 
-                mask="auto"
-            )
-        
-        if os.path.exists("emma.png"):
-            canvas.drawImage(
-                "emma.png", 
-                x_start - 2 * (image_width + 0.1 * inch),
-                y_position, 
-                width=image_width, 
-                height=image_height, 
-                mask="auto"
-            )
-        
-        # Add Header Text using Lato Bold
-        canvas.setFont(bold_font, 24)
-        canvas.drawString(doc.leftMargin, doc.height + doc.topMargin - 0.1*inch, 
-                         "ESG Starter's Kit")
-
-        # Draw line below the header text
-        line_y_position = doc.height + doc.topMargin - 0.30 * inch
-        canvas.setLineWidth(0.5)
-        canvas.line(doc.leftMargin, line_y_position, doc.width + doc.rightMargin, line_y_position)
-
-        # Footer using regular Lato
-        canvas.setFont(base_font, 9)
-        canvas.drawString(doc.leftMargin, 0.5 * inch, 
-                          f"Generated on {datetime.datetime.now().strftime('%B %d, %Y')}")
-        canvas.drawRightString(doc.width + doc.rightMargin, 0.5 * inch, 
-                               f"Page {doc.page}")
-    canvas.restoreState()
-def create_header_footer_disclaimer(canvas, doc):
-    """Add header and footer with smaller, transparent images in the top right and a line below the header."""
-    canvas.saveState()
-    
-    # Register Lato fonts if available
-    try:
-        pdfmetrics.registerFont(TTFont('Lato', 'fonts/Lato-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('Lato-Bold', 'fonts/Lato-Bold.ttf'))
-        base_font = 'Lato'
-        bold_font = 'Lato-Bold'
-    except:
-        # Fallback to Helvetica if Lato fonts are not available
-        base_font = 'Helvetica'
-        bold_font = 'Helvetica-Bold'
-    
-    if doc.page > 1:  # Only show on pages after the first page
-        # Adjust the position to the top right
-        x_start = doc.width + doc.leftMargin - 1.0 * inch  # Align closer to the right
-        y_position = doc.height + doc.topMargin - 0.1 * inch  # Slightly below the top margin
-        image_width = 0.5 * inch  # Smaller width
-        image_height = 0.5 * inch  # Smaller height
-
-        # Draw images (ensure they are saved with transparent backgrounds)
-        if os.path.exists("ceai.png"):
-            canvas.drawImage(
-                "ceai.png", 
-                x_start, 
-                y_position, 
-                width=image_width, 
-                height=image_height, 
-                mask="auto"
-            )
-        
-        if os.path.exists("raa.png"):
-            canvas.drawImage(
-                "raa.png", 
-                x_start - image_width - 0.1 * inch,
-                y_position, 
-                width=image_width, 
-                height=image_height, 
-                mask="auto"
-            )
-        
-        if os.path.exists("emma.png"):
-            canvas.drawImage(
-                "emma.png", 
-                x_start - 2 * (image_width + 0.1 * inch),
-                y_position, 
-                width=image_width, 
-                height=image_height, 
-                mask="auto"
-            )
-        
-        # Add Header Text - Fixed by properly setting font name and size
-        canvas.setFont(bold_font, 27)  # Set font with name and size
-        canvas.drawString(doc.leftMargin, doc.height + doc.topMargin - 0.1*inch, 
-                         "Disclaimer")
-
-        # Draw line below the header text
-        line_y_position = doc.height + doc.topMargin - 0.30 * inch
-        canvas.setLineWidth(0.5)
-        canvas.line(doc.leftMargin, line_y_position, doc.width + doc.rightMargin, line_y_position)
-
-        # Footer - Fixed by properly setting font name and size
-        canvas.setFont(base_font, 9)  # Set font with name and size
-        canvas.drawString(doc.leftMargin, 0.5 * inch, 
-                         f"Generated on {datetime.datetime.now().strftime('%B %d, %Y')}")
-        canvas.drawRightString(doc.width + doc.rightMargin, 0.5 * inch, 
-                             f"Page {doc.page}")
-    
-    canvas.restoreState()
-def get_esg_analysis1(user_data, api_key):
-    """Initial ESG analysis based on profile"""
-    client = OpenAI(api_key=api_key)
-    
-    prompt = f"""Based on this organization's profile and ESG readiness responses:
-    {user_data}
-    
-    Provide a 535-word analysis with specific references to the data provided, formatted
-    in narrative form with headers and paragraphs.NO NUMBERING POINTS"""
+            conformed[field] = conform_to_schema(value[field], spec, f"{path}.{field}", errors)[0]
+    return conformed, errors
 
+def parse_structured(content, schema):
+    """Parse a JSON response and check it against schema; returns (data, errors)"""
+    content = content.strip()
+    if content.startswith('```'):
+        # Models sometimes fence their JSON despite being asked not to
+        content = content.strip('`').removeprefix('json').strip()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+        data = json.loads(content)
+    except ValueError as e:
+        return None, [f"not valid JSON: {e}"]
+    return conform_to_schema(data, schema)
+
+def structured_completion(api_key, prompt, stage):
+    """Validated JSON result for a stage, repaired by a second call if needed"""
+    schema = STAGE_SCHEMAS[stage]
+    route = stage_route(stage, json_mode=True)
+    content = create_completion(
+        api_key, stage_prompt(prompt, stage) + structured_instructions(schema), stage=stage,
+        json_mode=True, system=PROMPT_PREAMBLE, **route
+    )
+    data, errors = parse_structured(content, schema)
+    if errors:
+        _note_stage_metrics(repaired=True)
+        repair_prompt = f"""This JSON response does not match the required shape:
+{content}
+
+Problems: {'; '.join(errors[:10])}
+
+Return the corrected JSON object, keeping its content.{structured_instructions(schema)}"""
+        content = create_completion(
+            api_key, repair_prompt, STRUCTURED_REPAIR_MODEL, temperature=0,
+            stage=stage, json_mode=True, max_tokens=route['max_tokens']
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"Error getting initial analysis: {str(e)}")
+        data, errors = parse_structured(content, schema)
+        if errors:
+            raise CompletionError(f"The model returned invalid structured output: {errors[0]}")
+    # Stored compactly with a stable key order, so equal results compare equal
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+def complete_stage(api_key, prompt, stage, on_text=None):
+    """Completion for a pipeline stage: markdown, or validated JSON in structured mode.
+
+    prompt is the stage's report_context; the instructions from
+    STAGE_PROMPTS follow it and the model and length come from
+    STAGE_ROUTING. Structured results are not
+    streamed; on_text receives the rendered result once it has been validated.
+    """
+    if OUTPUT_MODE != "json":
+        return create_completion(
+            api_key, stage_prompt(prompt, stage), stage=stage, on_text=on_text,
+            system=PROMPT_PREAMBLE, **stage_route(stage)
+        )
+    result = structured_completion(api_key, prompt, stage)
+    if on_text is not None:
+        on_text(result_markdown(result))
+    return result
+
+def structured_data(result):
+    """The fields of a structured stage result, or None for a markdown result"""
+    if not result or not result.startswith('{'):
         return None
+    try:
+        data = json.loads(result)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) and 'sections' in data else None
 
-def get_esg_analysis2(user_data, api_key):
-    """Get organization-specific ESG recommendations, supporting multiple organization types."""
-    import json
-    from openai import OpenAI
-
-    client = OpenAI(api_key=api_key)
-    user_data_str = json.dumps(user_data, indent=2)
-
-    # ESG frameworks for various organization types
-    prompts = {
-        "Public Listed Company": [
-            "Bursa Malaysia Sustainability Reporting Guide (3rd Edition)",
-            "Securities Commission Malaysia (SC): Malaysian Code on Corporate Governance (MCCG)",
-            "Global Reporting Initiative (GRI)",
-            "Task Force on Climate-related Financial Disclosures (TCFD)",
-            "Sustainability Accounting Standards Board (SASB)",
-            "GHG Protocol",
-            "ISO 14001",
-            "ISO 26000",
-        ],
-        "Financial Institution": [
-            "Bank Negara Malaysia (BNM) Climate Change and Principle-based Taxonomy (CCPT)",
-            "Malaysian Sustainable Finance Roadmap",
-            "Principles for Responsible Banking (PRB)",
-            "Task Force on Climate-related Financial Disclosures (TCFD)",
-            "Sustainability Accounting Standards Board (SASB)",
-            "GHG Protocol",
-            "ISO 14097",
-        ],
-        "SME/Enterprise": [
-            "Simplified ESG Disclosure Guide (SEDG)",
-            "Bursa Malaysia's Basic Sustainability Guidelines for SMEs",
-            "ISO 14001",
-            "Global Reporting Initiative (GRI)",
-            "GHG Protocol",
-            "ISO 26000",
-            "Sustainability Accounting Standards Board (SASB)",
-        ],
-        "Government Agency": [
-            "Malaysian Code on Corporate Governance (MCCG)",
-            "United Nations Sustainable Development Goals (SDGs)",
-            "International Public Sector Accounting Standards (IPSAS)",
-            "ISO 26000",
-            "GHG Protocol",
-        ],
-        "NGO": [
-            "Global Reporting Initiative (GRI)",
-            "Social Value International (SVI)",
-            "ISO 26000",
-            "United Nations Sustainable Development Goals (SDGs)",
-            "GHG Protocol",
-        ],
-        "Others": [
-            "UN Principles for Responsible Management Education (PRME)",
-            "ISO 26000",
-            "Sustainability Development Goals (SDGs)",
-            "GHG Protocol",
-            "ISO 14001",
+def structured_blocks(data):
+    """Yield (kind, text) for the content of a structured result, in reading order.
+
+    kind is 'heading', 'paragraph', 'point' or 'bullet', as in parse_markdown.
+    """
+    if data.get('summary'):
+        yield 'paragraph', data['summary']
+    for section in data['sections']:
+        if section['heading']:
+            yield 'heading', section['heading']
+        for paragraph in section['paragraphs']:
+            yield 'paragraph', paragraph
+        for point in section['points']:
+            yield 'point', point
+    if data.get('issues'):
+        yield 'heading', "Key Issues"
+        for issue in data['issues']:
+            yield 'point', f"**{issue['title']}**: {issue['detail']}"
+    if data.get('frameworks'):
+        yield 'heading', "Frameworks Referenced"
+        for framework in data['frameworks']:
+            yield 'bullet', framework
+    if data.get('ratios'):
+        yield 'heading', "SROI Ratios"
+        for ratio in data['ratios']:
+            yield 'bullet', (
+                f"{ratio['label']}: RM {ratio['investment_rm']:,.0f} invested, "
+                f"RM {ratio['social_value_rm']:,.0f} social value, ratio 1:{ratio['ratio']:g}"
+            )
+
+def report_content(result):
+    """A stage result as laid out in the PDF: markdown, or the blocks of a structured result"""
+    data = structured_data(result)
+    return result if data is None else list(structured_blocks(data))
+
+def result_markdown(result):
+    """A stage result as markdown for display"""
+    data = structured_data(result)
+    if data is None:
+        return result
+    lines = []
+    number = 0
+    for kind, text in structured_blocks(data):
+        number = number + 1 if kind == 'point' else 0
+        if kind == 'heading':
+            lines.append(f"### {text}")
+        elif kind == 'point':
+            lines.append(f"{number}. {text}")
+        elif kind == 'bullet':
+            lines.append(f"- {text}")
+        else:
+            lines.append(text)
+    return '\n\n'.join(lines)
+
+# Prompt context compaction: downstream stages receive a structured digest
+# of each earlier analysis instead of its full text. Set ESG_PROMPT_CONTEXT
+# to "full" to send the complete text as before.
+PROMPT_CONTEXT_MODE = os.environ.get("ESG_PROMPT_CONTEXT", "digest")  # "digest" or "full"
+DIGEST_MAX_FINDINGS = 8
+DIGEST_MAX_ITEM_WORDS = 30
+
+STAGE_LABELS = {
+    'analysis1': "Initial ESG Assessment",
+    'analysis2': "Framework Analysis",
+    'management_questions': "Management Issues",
+    'question_rationale': "Issue Rationale",
+    'implementation_challenges': "Implementation Challenges",
+    'advisory': "Advisory Plan",
+    'sroi': "SROI Model"
+}
+
+_DIGEST_HEADING_RE = re.compile(r'^(?:#{1,6}\s*(.+?)\s*#*|\*\*([^*]+)\*\*:?)$')
+_DIGEST_NUMBERED_RE = re.compile(r'^\d+[.)]\s+(.+)')
+_DIGEST_BULLET_RE = re.compile(r'^[-*•]\s+(.+)')
+_DIGEST_MARKUP_RE = re.compile(r'[*_`#]')
+_DIGEST_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Short names used to spot framework citations, e.g. "GRI" for
+# "Global Reporting Initiative (GRI)"
+_FRAMEWORK_NAMES = {
+    framework: re.findall(r'\(([A-Z][A-Za-z]+)\)', framework) or [framework]
+    for frameworks in ESG_FRAMEWORKS.values()
+    for framework in frameworks
+}
+
+def _digest_item(text):
+    words = _DIGEST_MARKUP_RE.sub('', text).split()
+    item = ' '.join(words[:DIGEST_MAX_ITEM_WORDS])
+    return item + ('...' if len(words) > DIGEST_MAX_ITEM_WORDS else '')
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def build_digest(text):
+    """Structured digest of a stage's output.
+
+    Returns a dict with the section headings, key findings (the first
+    sentence of each paragraph), frameworks cited and numbered issues.
+    Digests are cached, so each output is only digested once.
+    """
+    data = structured_data(text)
+    if data is not None:
+        return structured_digest(data)
+    digest = {'headings': [], 'key_findings': [], 'frameworks': [], 'issues': []}
+    for line in (text or '').split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        heading = _DIGEST_HEADING_RE.match(line)
+        numbered = _DIGEST_NUMBERED_RE.match(line)
+        if heading:
+            digest['headings'].append(_digest_item(heading.group(1) or heading.group(2)))
+        elif numbered:
+            digest['issues'].append(_digest_item(numbered.group(1)))
+        elif not _DIGEST_BULLET_RE.match(line) and len(digest['key_findings']) < DIGEST_MAX_FINDINGS:
+            digest['key_findings'].append(_digest_item(_DIGEST_SENTENCE_RE.split(line, 1)[0]))
+    digest['frameworks'] = [
+        framework for framework, names in _FRAMEWORK_NAMES.items()
+        if any(name in (text or '') for name in names)
+    ]
+    return digest
+
+def structured_digest(data):
+    """Digest of a structured result, taken directly from its fields"""
+    paragraphs = [data['summary']] + [
+        paragraph for section in data['sections'] for paragraph in section['paragraphs']
+    ]
+    return {
+        'headings': [_digest_item(section['heading']) for section in data['sections']],
+        'key_findings': [
+            _digest_item(_DIGEST_SENTENCE_RE.split(paragraph.strip(), 1)[0])
+            for paragraph in paragraphs if paragraph.strip()
+        ][:DIGEST_MAX_FINDINGS],
+        'frameworks': data.get('frameworks') or [
+            framework for framework, names in _FRAMEWORK_NAMES.items()
+            if any(name in paragraph for paragraph in paragraphs for name in names)
         ],
+        'issues': [_digest_item(issue['title']) for issue in data.get('issues', [])] or [
+            _digest_item(point) for section in data['sections'] for point in section['points']
+        ]
     }
 
-    # Get organization types from user_data
-    org_types = user_data.get("organization_types", [])
-    if not org_types:
-        org_types = ["Others"]  # Default to Others if no type is specified
-    
-    # Create a section for each selected organization type
-    org_type_sections = []
-    all_frameworks = set()  # To track unique frameworks across all types
-    
-    for org_type in org_types:
-        frameworks = prompts.get(org_type, prompts["Others"])
-        all_frameworks.update(frameworks)
-        org_type_sections.append(f"""
-Organization Type: {org_type}
-Relevant Frameworks:
-{chr(10).join('- ' + framework for framework in frameworks)}
-""")
+def format_digest(label, digest):
+    """Render a digest as compact prompt text"""
+    lines = [f"[{label}]"]
+    if digest['headings']:
+        lines.append("Sections: " + "; ".join(digest['headings']))
+    if digest['key_findings']:
+        lines.append("Key findings:")
+        lines.extend(f"- {finding}" for finding in digest['key_findings'])
+    if digest['frameworks']:
+        lines.append("Frameworks cited: " + "; ".join(digest['frameworks']))
+    if digest['issues']:
+        lines.append("Issues:")
+        lines.extend(f"{i}. {issue}" for i, issue in enumerate(digest['issues'], 1))
+    return '\n'.join(lines)
 
-    # Create the full prompt with sections for each organization type
-    full_prompt = f"""
-As an ESG consultant specializing in Malaysian standards and frameworks, provide a comprehensive analysis for an organization with multiple classifications:
+def stage_context(text, stage):
+    """Text of an earlier stage as passed to a downstream prompt"""
+    if PROMPT_CONTEXT_MODE == "full":
+        return text
+    return format_digest(STAGE_LABELS.get(stage, stage), build_digest(text))
 
-Organization Profile:
-{user_data_str}
+def report_context(user_data, analyses=None, full=()):
+    """The per-report part of a prompt: the profile, then earlier results in pipeline order.
 
-This organization operates under multiple classifications:
-{chr(10).join(org_type_sections)}
+    Every stage of a report renders this the same way, so their prompts
+    share it as a prefix. Results of the stages in `full` are given in full
+    text rather than as a digest.
+    """
+    parts = [f"Organization Profile:\n{json.dumps(user_data, indent=2)}"]
+    for stage in PIPELINE_STAGES:
+        if analyses and analyses.get(stage) is not None:
+            text = analyses[stage]
+            if stage in full:
+                text = f"[{STAGE_LABELS[stage]}]\n{text}"
+            else:
+                text = stage_context(text, stage)
+                if PROMPT_CONTEXT_MODE == "full":
+                    text = f"[{STAGE_LABELS[stage]}]\n{text}"
+            parts.append(text)
+    return '\n\n'.join(parts)
+
+# Prompt layout: completion APIs cache prompt prefixes they have seen
+# recently, and the cached part of a prompt is read faster and billed
+# cheaper (OpenAI: gpt-4o and newer models, prompts from 1024 tokens, in
+# steps of 128 tokens). Every call therefore sends the same system message,
+# then the per-report context in a fixed order (profile, then earlier
+# results in pipeline order, see report_context) and the stage's
+# instructions last. Later stages of a report then repeat the prompt of an
+# earlier one as their prefix, e.g. the SROI model repeats everything the
+# advisory plan was given. {words} in the instructions is the stage's word
+# target from STAGE_ROUTING.
+PROMPT_PREAMBLE = """You are an ESG consultant specializing in Malaysian standards and frameworks, writing one section of an ESG assessment report for an organization.
+Write numbers, currencies (e.g. "RM 1,000") and ratios in plain text, without mathematical notation.
+The user message gives the organization's data and the earlier analyses of the report, followed by the instructions for the section to write."""
 
-Please provide:
+STAGE_PROMPTS = {
+    'analysis1': """Provide a {words}-word analysis of the organization's profile and ESG readiness
+responses, with specific references to the data provided, formatted in narrative form with
+headers and paragraphs. NO NUMBERING POINTS""",
+    'analysis2': """Provide a comprehensive analysis for the organization, which may have several
+organization types, using the relevant frameworks given for each of its types:
 1. A detailed analysis of how each framework applies to this specific organization
 2. Areas of overlap between different frameworks that create synergies
 3. Potential conflicts or challenges in implementing multiple framework requirements
 4. Recommendations for prioritizing and harmonizing framework implementation
 5. Specific examples of how the organization can benefit from its multi-framework approach
 
-Write in narrative form (450 words) with headers and Numbering points(no bullet points), including:
+Write in narrative form ({words} words) with headers and Numbering points(no bullet points), including:
 - Supporting facts and figures
 - Specific references for each organization type
 - Cross-framework integration strategies
 - Implementation recommendations
 
-Focus on practical implementation while acknowledging the complexity of managing multiple frameworks."""
+Focus on practical implementation while acknowledging the complexity of managing multiple frameworks.""",
+    'baseline': """Provide a framework analysis for a typical organization of the given organization
+type in the given industry, using the relevant frameworks given for that type:
+1. A detailed analysis of how each framework applies to organizations of this type in this industry
+2. Areas of overlap between the frameworks that create synergies
+3. Potential conflicts or challenges in implementing the framework requirements
+4. Recommendations for prioritizing and harmonizing framework implementation
+5. Specific examples of how such an organization can benefit from the frameworks
+
+Write in narrative form ({words} words) with headers and Numbering points(no bullet points), including:
+- Supporting facts and figures
+- Industry-specific references
+- Implementation recommendations
 
-    # Process the prompt with OpenAI's API
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[{"role": "user", "content": full_prompt}],
-            temperature=0.7
+Do not refer to a specific organization by name.""",
+    'personalization': """Personalize the given baseline framework analysis for one organization.
+Write {words} words in narrative form with Numbering points(no bullet points) on what the
+frameworks mean for this organization specifically: its core activities, its readiness answers,
+how its organization types overlap or conflict if it has several, and where it should start.
+Do not repeat the baseline analysis and do not add a title.""",
+    'management_questions': """Based on the previous analyses, generate a list of top 10
+issues/questions that Management should address in numbering Points.
+Format as {words}-words in narrative form with:
+- Clear headers for key areas
+- Bullet points identifying specific issues
+- Supporting facts and figures
+- Industry-specific references""",
+    'question_rationale': """Based on the management issues and previous analyses, provide a
+{words}-word (no numbering points)explanation of why each issue needs to be addressed, with:
+- Specific references to ESG guidelines and standards
+- Industry best practices
+- Supporting facts and figures
+- Framework citations""",
+    'implementation_challenges': """Based on the previous analyses, provide a {words}-word(no
+numbering points) analysis of potential ESG implementation challenges covering:
+1. Human Capital Availability and Expertise
+2. Budgeting and Financial Resources
+3. Infrastructure
+4. Stakeholder Management
+5. Regulatory Compliance
+6. Other Challenges
+
+Format in narrative form with supporting facts and specific references.""",
+    'advisory': """Based on the organization data and all previous analyses ({words} words): Explain what and how ESG Advisory
+team can assist in numbering points, including:
+- Implementation support methods
+- Technical expertise areas
+- Training programs
+- Monitoring systems
+
+Include supporting facts, figures, and statistical references.""",
+    'sroi': """Based on the organization data and all previous analyses ({words} words): Provide a Social Return on Investment
+(SROI) model with(in numbering points):
+1. Calculation Methodology:
+- Explain SROI calculations using plain text (avoid mathematical notation)
+- Example: "For every 1 dollar invested, X value is generated" instead of mathematical formulas
+- Use clear, narrative descriptions of calculations
+
+2. Financial Projections:
+- Present numbers in plain text format
+- Use clear currency formatting (e.g., "RM 1,000" instead of mathematical notation)
+- Write ratios in plain language
+
+3. Implementation Guidelines:
+- Use clear, narrative text
+- Avoid special characters or mathematical symbols
+- Present steps in numbered format
+
+Format all numerical examples in plain text with proper spacing.""",
+}
+
+def stage_prompt(context, stage):
+    """User message of a stage: the per-report context, then the stage's instructions"""
+    instructions = STAGE_PROMPTS[stage].format(words=STAGE_ROUTING[stage]['words'])
+    return f"{context}\n\nInstructions:\n{instructions}"
+
+def get_esg_analysis1(user_data, api_key, on_text=None):
+    """Initial ESG analysis based on profile"""
+    # Only the session 1 fields, which are all analysis 1 is generated from
+    prompt = report_context({field: user_data.get(field) for field in PROFILE_FIELDS})
+
+    return complete_stage(
+        api_key, prompt, stage='analysis1', on_text=on_text
+    )
+
+def framework_sections(org_types):
+    """Prompt text listing the relevant frameworks of each organization type"""
+    org_type_sections = []
+    for org_type in org_types:
+        frameworks = ESG_FRAMEWORKS.get(org_type, ESG_FRAMEWORKS["Others"])
+        org_type_sections.append(f"""
+Organization Type: {org_type}
+Relevant Frameworks:
+{chr(10).join('- ' + framework for framework in frameworks)}
+""")
+    return chr(10).join(org_type_sections)
+
+# Framework baselines: a generic framework analysis for every industry and
+# organization type, generated offline by precompute_baselines.py. When
+# baselines exist for an organization's industry and all of its types, the
+# framework analysis is those baselines plus a short generated
+# personalization instead of a full generation. Baselines are not used for
+# structured (JSON mode) output or when the user listed their own frameworks.
+BASELINES_ENABLED = os.environ.get("ESG_BASELINES", "1") != "0"
+
+def _open_baseline_store():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Kept apart per backend, like the completion cache keys
+    name = "baselines.sqlite" if LLM_BACKEND == 'openai' else f"baselines-{LLM_BACKEND}.sqlite"
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, name), timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS baselines ("
+        "industry TEXT NOT NULL, organization_type TEXT NOT NULL, content TEXT NOT NULL, "
+        "created REAL NOT NULL, PRIMARY KEY (industry, organization_type))"
+    )
+    return conn
+
+def get_baselines(industry, org_types):
+    """Stored baselines for industry by organization type; types without one are left out"""
+    with closing(_open_baseline_store()) as conn, conn:
+        rows = conn.execute(
+            f"SELECT organization_type, content FROM baselines WHERE industry = ? "
+            f"AND organization_type IN ({', '.join('?' * len(org_types))})",
+            (industry, *org_types)
+        ).fetchall()
+    return dict(rows)
+
+def put_baseline(industry, org_type, content):
+    with closing(_open_baseline_store()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO baselines (industry, organization_type, content, created) "
+            "VALUES (?, ?, ?, ?)",
+            (industry, org_type, content, time.time())
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error getting ESG analysis: {str(e)}"
-def generate_management_questions(analysis1, analysis2, api_key):
+
+def generate_baseline(industry, org_type, api_key, refresh=False):
+    """Generate and store the baseline framework analysis for one industry and organization type"""
+    prompt = f"""Industry: {industry}
+{framework_sections([org_type])}"""
+
+    content = create_completion(
+        api_key, stage_prompt(prompt, 'baseline'), stage='baseline', system=PROMPT_PREAMBLE,
+        refresh=refresh, **stage_route('baseline')
+    )
+    put_baseline(industry, org_type, content)
+    return content
+
+def personalize_framework_analysis(user_data, baselines, api_key, on_text=None):
+    """Framework analysis made of stored baselines plus a generated personalization"""
+    org_types = list(baselines)
+    if len(org_types) == 1:
+        baseline_text = baselines[org_types[0]]
+    else:
+        baseline_text = '\n\n'.join(f"## {org_type}\n\n{baselines[org_type]}" for org_type in org_types)
+    heading = f"## What This Means for {user_data['organization_name']}"
+    prompt = f"""{report_context(user_data)}
+
+Baseline analysis for organizations of type {', '.join(org_types)} in the {user_data['industry']} industry:
+{stage_context(baseline_text, 'analysis2')}"""
+
+    def stream(text):
+        on_text(f"{baseline_text}\n\n{heading}\n\n{text}")
+
+    personalization = create_completion(
+        api_key, stage_prompt(prompt, 'personalization'), stage='analysis2', system=PROMPT_PREAMBLE,
+        on_text=None if on_text is None else stream, **stage_route('personalization')
+    )
+    return f"{baseline_text}\n\n{heading}\n\n{personalization}"
+
+def get_esg_analysis2(user_data, api_key, on_text=None):
+    """Get organization-specific ESG recommendations, supporting multiple organization types."""
+    # Get organization types from user_data
+    org_types = user_data.get("organization_types", [])
+    if not org_types:
+        org_types = ["Others"]  # Default to Others if no type is specified
+
+    # Frameworks the user typed in are not covered by any baseline
+    if BASELINES_ENABLED and OUTPUT_MODE == "markdown" and not user_data.get("other_frameworks"):
+        baselines = get_baselines(user_data.get("industry"), org_types)
+        if len(baselines) == len(set(org_types)):
+            return personalize_framework_analysis(
+                user_data, {org_type: baselines[org_type] for org_type in org_types}, api_key, on_text
+            )
+
+    full_prompt = f"""{report_context(user_data)}
+
+This organization operates under multiple classifications:
+{framework_sections(org_types)}"""
+
+    # Process the prompt with OpenAI's API
+    return complete_stage(
+        api_key, full_prompt, stage='analysis2', on_text=on_text
+    )
+def generate_management_questions(user_data, analysis1, analysis2, api_key, on_text=None):
     """Generate top 10 management issues/questions"""
-    client = OpenAI(api_key=api_key)
-    
-    prompt = f"""Based on the previous analyses:
-    {analysis1}
-    {analysis2}
-    
-    Generate a list of top 10 issues/questions that Management should address in numbering Points.
-    Format as  650-words in narrative form with:
-    - Clear headers for key areas
-    - Bullet points identifying specific issues
-    - Supporting facts and figures
-    - Industry-specific references"""
+    # The issues are drawn from the analyses themselves, not their digests
+    prompt = report_context(
+        user_data, {'analysis1': analysis1, 'analysis2': analysis2},
+        full=('analysis1', 'analysis2')
+    )
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7  # Increased token limit
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"Error generating management questions: {str(e)}")
-        return None
+    return complete_stage(
+        api_key, prompt, stage='management_questions', on_text=on_text
+    )
 
-def generate_question_rationale(questions, analysis1, analysis2, api_key):
+def generate_question_rationale(user_data, questions, analysis1, analysis2, api_key, on_text=None):
     """Generate rationale for management questions"""
-    client = OpenAI(api_key=api_key)
-    
-    prompt = f"""Based on these management issues and previous analyses:
-    {questions}
-    {analysis1}
-    {analysis2}
-    
-    Provide a 680-word (no numbering points)explanation of why each issue needs to be addressed, with:
-    - Specific references to ESG guidelines and standards
-    - Industry best practices
-    - Supporting facts and figures
-    - Framework citations"""
+    # Every issue is explained, so they are given in full
+    prompt = report_context(
+        user_data, {'analysis1': analysis1, 'analysis2': analysis2, 'management_questions': questions},
+        full=('management_questions',)
+    )
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"Error generating management questions: {str(e)}")
-        return None
+    return complete_stage(
+        api_key, prompt, stage='question_rationale', on_text=on_text
+    )
 
-def generate_implementation_challenges(analysis1, analysis2, questions, api_key):
+def generate_implementation_challenges(user_data, analysis1, analysis2, questions, api_key, on_text=None):
     """Generate implementation challenges analysis"""
-    client = OpenAI(api_key=api_key)
-    
-    prompt = f"""Based on the previous analyses:
-    {analysis1}
-    {analysis2}
-    {questions}
-    
-    Provide a 680-word(no numbering points) analysis of potential ESG implementation challenges covering:
-    1. Human Capital Availability and Expertise
-    2. Budgeting and Financial Resources
-    3. Infrastructure
-    4. Stakeholder Management
-    5. Regulatory Compliance
-    6. Other Challenges
-    
-    Format in narrative form with supporting facts and specific references."""
+    prompt = report_context(
+        user_data, {'analysis1': analysis1, 'analysis2': analysis2, 'management_questions': questions}
+    )
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"Error generating challenges analysis: {str(e)}")
-        return None
-def generate_advisory_analysis(user_data, all_analyses, api_key):
+    return complete_stage(
+        api_key, prompt, stage='implementation_challenges', on_text=on_text
+    )
+
+def generate_advisory_analysis(user_data, all_analyses, api_key, on_text=None):
     """Generate advisory plan and SROI model"""
-    client = OpenAI(api_key=api_key)
-    
-    prompt = f"""Based on all previous analyses:
-    {user_data}
-    {all_analyses}
-    
-     (480 words): Explain what and how ESG Advisory team can assist in numbering points, including:
-    - Implementation support methods
-    - Technical expertise areas
-    - Training programs
-    - Monitoring systems
-    
-    Include supporting facts, figures, and statistical references."""
+    prompt = report_context(user_data, all_analyses)
 
+    return complete_stage(
+        api_key, prompt, stage='advisory', on_text=on_text
+    )
+
+def generate_sroi_analysis(user_data, all_analyses, api_key, on_text=None):
+    """Generate advisory plan and SROI model"""
+    prompt = report_context(user_data, all_analyses)
+
+    return complete_stage(
+        api_key, prompt, stage='sroi', on_text=on_text
+    )
+
+# Report pipeline: each stage declares the results it needs as inputs.
+# Every stage whose inputs are ready runs at the same time, so the total
+# time is the longest chain of stages rather than the sum of all of them.
+PIPELINE_MAX_WORKERS = 4
+
+# The session 1 form fields. Analysis 1 is generated before the organization
+# types are chosen, so it only depends on these.
+PROFILE_FIELDS = ['organization_name', 'industry', 'core_activities', 'esg_responses']
+
+PIPELINE_STAGES = {
+    'analysis1': {
+        'inputs': ['user_data'],
+        'user_fields': PROFILE_FIELDS,
+        'run': lambda r, api_key, on_text: get_esg_analysis1(r['user_data'], api_key, on_text)
+    },
+    'analysis2': {
+        'inputs': ['user_data'],
+        'run': lambda r, api_key, on_text: get_esg_analysis2(r['user_data'], api_key, on_text)
+    },
+    'management_questions': {
+        'inputs': ['user_data', 'analysis1', 'analysis2'],
+        'run': lambda r, api_key, on_text: generate_management_questions(
+            r['user_data'], r['analysis1'], r['analysis2'], api_key, on_text)
+    },
+    'question_rationale': {
+        'inputs': ['user_data', 'management_questions', 'analysis1', 'analysis2'],
+        'run': lambda r, api_key, on_text: generate_question_rationale(
+            r['user_data'], r['management_questions'], r['analysis1'], r['analysis2'], api_key, on_text)
+    },
+    'implementation_challenges': {
+        'inputs': ['user_data', 'analysis1', 'analysis2', 'management_questions'],
+        'run': lambda r, api_key, on_text: generate_implementation_challenges(
+            r['user_data'], r['analysis1'], r['analysis2'], r['management_questions'], api_key, on_text)
+    },
+    'advisory': {
+        'inputs': ['user_data', 'analysis1', 'analysis2', 'management_questions',
+                   'question_rationale', 'implementation_challenges'],
+        'run': lambda r, api_key, on_text: generate_advisory_analysis(
+            r['user_data'],
+            {key: r[key] for key in PIPELINE_STAGES['advisory']['inputs'][1:]},
+            api_key, on_text)
+    },
+    'sroi': {
+        'inputs': ['user_data', 'analysis1', 'analysis2', 'management_questions',
+                   'question_rationale', 'implementation_challenges', 'advisory'],
+        'run': lambda r, api_key, on_text: generate_sroi_analysis(
+            r['user_data'],
+            {key: r[key] for key in PIPELINE_STAGES['sroi']['inputs'][1:]},
+            api_key, on_text)
+    }
+}
+
+def stage_inputs(stage, results):
+    """The inputs a stage is generated from, limited to the user_data fields it uses"""
+    spec = PIPELINE_STAGES[stage]
+    inputs = {key: results.get(key) for key in spec['inputs']}
+    if 'user_fields' in spec and inputs.get('user_data') is not None:
+        inputs['user_data'] = {
+            field: inputs['user_data'][field]
+            for field in spec['user_fields'] if field in inputs['user_data']
+        }
+    return inputs
+
+def stage_fingerprint(stage, results):
+    """Hash of the inputs a stage would be generated from"""
+    key = [stage, stage_inputs(stage, results)]
+    if OUTPUT_MODE != "markdown":
+        key.append(OUTPUT_MODE)  # Switching modes regenerates the stage
+    payload = json.dumps(key, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def stage_is_current(stage, results, fingerprints):
+    """True if results holds a result for stage that was generated from its current inputs"""
+    return results.get(stage) is not None and fingerprints.get(stage) == stage_fingerprint(stage, results)
+
+def _run_stage(stage, results, api_key, ctx, on_text, metrics):
+    """Run a single pipeline stage in a worker thread, filling in its metrics"""
+    if ctx is not None:
+        # Lets generators write to the page (errors, streamed text) from the worker thread
+        add_script_run_ctx(threading.current_thread(), ctx)
+    start = time.perf_counter()
+    metrics['queue_wait'] = start - metrics.pop('submitted')
+    _stage_metrics.current = metrics
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+        return PIPELINE_STAGES[stage]['run'](stage_inputs(stage, results), api_key, on_text)
+    finally:
+        _stage_metrics.current = None
+        metrics['wall_time'] = time.perf_counter() - start
+
+def run_pipeline(results, api_key, stages=None, max_workers=PIPELINE_MAX_WORKERS,
+                 on_text=None, on_stage_done=None, errors=None, fingerprints=None,
+                 report_id=None):
+    """Run pipeline stages concurrently as soon as their inputs are final.
+
+    `results` must already hold the inputs that are not produced by a stage
+    (e.g. 'user_data') and is updated in place. Without `fingerprints`,
+    stages already present in `results` are not rerun. With `fingerprints`
+    (stage -> fingerprint of the inputs its result was generated from,
+    updated in place) a stage is rerun only if its inputs changed, so an
+    edit recomputes just the stages downstream of it.
+
+    Stages whose inputs failed (returned None) are skipped and lose any
+    older result. `on_text` optionally maps stage names to streaming
+    callbacks, and `on_stage_done(stage, result)` is called as each stage
+    finishes. A stage that fails gets a None result; its error message is
+    added to the `errors` dict if one is given. Stage metrics are recorded
+    under `report_id`.
+    """
+    on_text = on_text or {}
+    if fingerprints is None:
+        pending = [stage for stage in (stages or PIPELINE_STAGES) if stage not in results]
+    else:
+        pending = list(stages or PIPELINE_STAGES)
+    ctx = get_script_run_ctx()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            scheduled = True
+            while scheduled:
+                # Reusing a result makes its dependents ready at once, so scan again
+                scheduled = False
+                running_stages = {stage for stage, _, _ in running.values()}
+                for stage in list(pending):
+                    inputs = PIPELINE_STAGES[stage]['inputs']
+                    if any(key in pending or key in running_stages for key in inputs):
+                        continue
+                    pending.remove(stage)
+                    scheduled = True
+                    if any(results.get(key) is None for key in inputs):
+                        results.pop(stage, None)
+                        if fingerprints is not None:
+                            fingerprints.pop(stage, None)
+                        continue
+                    if fingerprints is not None and stage_is_current(stage, results, fingerprints):
+                        record_metric('stage', report=report_id, stage=stage, status='reused')
+                        continue
+                    metrics = {'submitted': time.perf_counter()}
+                    future = executor.submit(
+                        _run_stage, stage, dict(results), api_key, ctx, on_text.get(stage), metrics
+                    )
+                    running[future] = (stage, stage_fingerprint(stage, results), metrics)
+                    running_stages.add(stage)
+            if not running:
+                # Nothing left that can run: either done or blocked by a failed input
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, fingerprint, metrics = running.pop(future)
+                try:
+                    results[stage] = future.result()
+                    if fingerprints is not None:
+                        fingerprints[stage] = fingerprint
+                except CompletionError as e:
+                    results[stage] = None
+                    if fingerprints is not None:
+                        fingerprints.pop(stage, None)
+                    if errors is not None:
+                        errors[stage] = str(e)
+                record_metric('stage', report=report_id, stage=stage,
+                              status='failed' if results[stage] is None else 'done', **metrics)
+                if on_stage_done is not None:
+                    on_stage_done(stage, results[stage])
+    return results
+
+# Report jobs: the generator chain and PDF build run in a process-wide worker
+# pool instead of the Streamlit script thread. Job state and results are kept
+# in SQLite, so reruns and closed tabs do not lose or duplicate work; the page
+# only polls the job. Jobs mostly wait on completions, so the pool is large;
+# the per-key rate limiter, not the pool, holds back a burst of reports.
+JOB_WORKERS = int(os.environ.get("ESG_JOB_WORKERS", 48))
+JOB_RETENTION = 7 * 24 * 3600  # seconds finished jobs are kept
+JOB_POLL_INTERVAL = 1.0  # seconds between status checks in the UI
+JOB_PARTIAL_WRITE_INTERVAL = 0.5  # seconds between saves of streamed text
+
+def _open_job_store():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, "jobs.sqlite"), timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, status TEXT NOT NULL, stages TEXT NOT NULL, "
+        "results TEXT NOT NULL, partial TEXT NOT NULL DEFAULT '{}', error TEXT, "
+        "pdf_path TEXT, created REAL NOT NULL, updated REAL NOT NULL, "
+        "fingerprints TEXT NOT NULL DEFAULT '{}')"
+    )
+    if 'fingerprints' not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+        # Job stores created before stage fingerprints were tracked
+        conn.execute("ALTER TABLE jobs ADD COLUMN fingerprints TEXT NOT NULL DEFAULT '{}'")
+    return conn
+
+def _update_job(job_id, **fields):
+    fields['updated'] = time.time()
+    for key in ('results', 'partial', 'stages', 'fingerprints'):
+        if key in fields:
+            fields[key] = json.dumps(fields[key])
+    with closing(_open_job_store()) as conn, conn:
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+            (*fields.values(), job_id)
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.error(f"Error generating advisory and SROI analysis: {str(e)}")
+
+def get_report_job(job_id):
+    """Current state of a report job as a dict, or None if it does not exist"""
+    with closing(_open_job_store()) as conn:
+        row = conn.execute(
+            "SELECT id, status, stages, results, partial, error, pdf_path, created, updated, "
+            "fingerprints FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    if row is None:
         return None
-def generate_sroi_analysis(user_data, all_analyses, api_key):
-    """Generate advisory plan and SROI model"""
-    client = OpenAI(api_key=api_key)
-    
-    prompt = f"""Based on all previous analyses:
-    {user_data}
-    {all_analyses}
-    
-    (730 words): Provide a Social Return on Investment (SROI) model with(in numbering points):
-    1. Calculation Methodology:
-    - Explain SROI calculations using plain text (avoid mathematical notation)
-    - Example: "For every 1 dollar invested, X value is generated" instead of mathematical formulas
-    - Use clear, narrative descriptions of calculations
-    
-    2. Financial Projections:
-    - Present numbers in plain text format
-    - Use clear currency formatting (e.g., "RM 1,000" instead of mathematical notation)
-    - Write ratios in plain language
-    
-    3. Implementation Guidelines:
-    - Use clear, narrative text
-    - Avoid special characters or mathematical symbols
-    - Present steps in numbered format
-    
-    Format all numerical examples in plain text with proper spacing."""
+    job = dict(zip(['id', 'status', 'stages', 'results', 'partial', 'error',
+                    'pdf_path', 'created', 'updated', 'fingerprints'], row))
+    for key in ('stages', 'results', 'partial', 'fingerprints'):
+        job[key] = json.loads(job[key])
+    return job
+
+def job_queue_position(job):
+    """Number of queued jobs submitted before job, i.e. waiting for a worker ahead of it"""
+    with closing(_open_job_store()) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?", (job['created'],)
+        ).fetchone()[0]
 
+@st.cache_resource
+def _job_executor():
+    """Process-wide worker pool for report jobs, kept across Streamlit reruns"""
+    # Jobs left queued or running by a previous process can never finish
+    with closing(_open_job_store()) as conn, conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart', "
+            "updated = ? WHERE status IN ('queued', 'running')", (time.time(),)
+        )
+    return ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="esg-job")
+
+def _run_report_job(job_id, api_key, results, stages, fingerprints, submitted):
+    """Worker: run the stages that are out of date and build the PDF, saving progress as it goes"""
+    from esg_pdf import PDF_SECTIONS, ReportBuilder, cached_report_pdf, report_pdf_key, store_report_pdf
+
+    start = time.time()
+    status = 'failed'
+    builder = None
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+        _update_job(job_id, status='running')
+        # Sections are turned into flowables while later stages are generated
+        builder = ReportBuilder()
+        pdf_keys = {key for _, key in PDF_SECTIONS}
+        for key in pdf_keys:
+            if results.get(key) is not None:
+                builder.add_section(key, report_content(results[key]))
+        partial = {}
+        last_write = [0.0]
+        lock = threading.Lock()
+
+        def stream_to_job(stage):
+            def on_text(text):
+                with lock:
+                    partial[stage] = text
+                    if time.monotonic() - last_write[0] >= JOB_PARTIAL_WRITE_INTERVAL:
+                        last_write[0] = time.monotonic()
+                        _update_job(job_id, partial=partial)
+            return on_text
+
+        def on_stage_done(stage, result):
+            if stage in pdf_keys and result is not None:
+                builder.add_section(stage, report_content(result))
+            with lock:
+                partial.pop(stage, None)
+                _update_job(job_id, results=results, partial=partial, fingerprints=fingerprints)
+
+        errors = {}
+        run_pipeline(
+            results, api_key, stages=stages,
+            on_text={stage: stream_to_job(stage) for stage in stages},
+            on_stage_done=on_stage_done, errors=errors, fingerprints=fingerprints,
+            report_id=job_id
         )
-        return response.choices[0].message.content
+        failed = [stage for stage in stages if results.get(stage) is None]
+        if failed:
+            _update_job(job_id, status='failed', results=results, fingerprints=fingerprints,
+                        error=describe_failures(failed, errors))
+            return
+
+        esg_data, personal_info = build_report_inputs(results['user_data'], results)
+        key = report_pdf_key(esg_data, personal_info)
+        pdf_path = cached_report_pdf(key)
+        if pdf_path is None:
+            build_start = time.perf_counter()
+            pdf_data = builder.build(personal_info).getvalue()
+            record_metric('pdf_build', report=job_id, seconds=time.perf_counter() - build_start,
+                          bytes=len(pdf_data))
+            pdf_path = store_report_pdf(key, pdf_data)
+        _update_job(job_id, status='done', results=results, fingerprints=fingerprints,
+                    pdf_path=pdf_path)
+        status = 'done'
     except Exception as e:
-        st.error(f"Error generating advisory and SROI analysis: {str(e)}")
-        return None
+        print(f"Detailed error: {str(e)}")
+        _update_job(job_id, status='failed', error=str(e))
+    finally:
+        if builder is not None:
+            builder.close()
+        record_metric('report', report=job_id, status=status, queue_wait=start - submitted,
+                      wall_time=time.time() - start)
+
+def describe_failures(failed, errors):
+    """Readable message for pipeline stages that produced no result"""
+    return "; ".join(
+        f"{STAGE_LABELS.get(stage, stage)}: {errors.get(stage, 'not generated because an earlier section failed')}"
+        for stage in failed
+    )
+
+def submit_report_job(results, api_key, stages=None, fingerprints=None):
+    """Queue a job running `stages` (default: all stages) and the PDF build.
+
+    `results` holds 'user_data' and any stage results already available.
+    With `fingerprints` (see run_pipeline) only stages whose inputs changed
+    are rerun; without, only the stages missing from `results` are run.
+    Returns the job id.
+    """
+    stages = list(stages or PIPELINE_STAGES)
+    if fingerprints is None:
+        stages = [stage for stage in stages if stage not in results]
+    fingerprints = dict(fingerprints or {})
+    # Start the pool first: on first use it fails jobs left over from a previous process
+    executor = _job_executor()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with closing(_open_job_store()) as conn, conn:
+        # Job PDFs live in the shared PDF cache, which evicts them itself
+        conn.execute("DELETE FROM jobs WHERE updated < ?", (now - JOB_RETENTION,))
+        conn.execute(
+            "INSERT INTO jobs (id, status, stages, results, fingerprints, created, updated) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(stages), json.dumps(results), json.dumps(fingerprints), now, now)
+        )
+    executor.submit(_run_report_job, job_id, api_key, dict(results), stages, fingerprints, now)
+    return job_id
+
+# Sections generated after the framework analysis, in display order
+REPORT_SECTIONS = [
+    ("3️⃣ Management Issues", 'management_questions'),
+    ("4️⃣ Issue Rationale", 'question_rationale'),
+    ("5️⃣ Implementation Challenges", 'implementation_challenges'),
+    ("6️⃣ Advisory Plan", 'advisory'),
+    ("7️⃣ SROI Model", 'sroi')
+]
+
+def session_results():
+    """user_data and the stage results held in the Streamlit session"""
+    return {
+        key: st.session_state[key]
+        for key in ['user_data', *PIPELINE_STAGES] if key in st.session_state
+    }
+
+def run_session_stage(stage, api_key, placeholder):
+    """Bring one stage of the Streamlit session up to date, streaming into placeholder.
+
+    The stage is only regenerated if its inputs changed. Returns the error
+    message if it failed, else None.
+    """
+    results = session_results()
+    errors = {}
+    run_pipeline(
+        results, api_key, stages=[stage], on_text={stage: stream_to(placeholder)},
+        errors=errors, fingerprints=st.session_state.fingerprints
+    )
+    if results.get(stage) is None:
+        st.session_state.pop(stage, None)
+        return errors.get(stage, "missing input")
+    st.session_state[stage] = results[stage]
+    return None
+
+def build_report_inputs(user_data, results):
+    """Build the esg_data and personal_info dicts passed to generate_pdf"""
+    esg_data = {
+        key: report_content(results[key])
+        for key in ['analysis1', 'analysis2', 'management_questions',
+                    'implementation_challenges', 'advisory', 'sroi']
+    }
+    personal_info = {
+        'organization_name': user_data['organization_name'],
+        'sector': user_data['industry'],  # Changed from 'industry' to 'sector' to match PDF template
+        'type': ', '.join(user_data['organization_types']),
+        'date': datetime.datetime.now().strftime('%B %d, %Y')
+    }
+    return esg_data, personal_info
+
 def render_header():
     """Render application header"""
     col1, col2 = st.columns([3, 1])
@@ -1114,21 +1832,50 @@ def render_header():
         logo_path = "finb.jpg"
         if os.path.exists(logo_path):
             st.image(logo_path, width=250)
+@st.cache_resource
+def warm_up():
+    """Import the OpenAI client and the PDF code in the background, once per process.
+
+    The first page renders without them; by the time the form is submitted
+    they are loaded.
+    """
+    def load():
+        importlib.import_module("openai")
+        import esg_pdf
+        esg_pdf.load_pdf_assets()
+
+    thread = threading.Thread(target=load, name="esg-warm-up", daemon=True)
+    thread.start()
+    return thread
+
 def main():
     st.set_page_config(page_title="ESG Starter's Kit", layout="wide")
     
     st.title("ESG Starter's Kit")
     render_header()
+    warm_up()
     # API Key input in sidebar
     with st.sidebar:
         api_key = st.text_input("OpenAI API Key", type="password")
-        if not api_key:
+        if not api_key and LLM_BACKEND != 'fake':
             st.warning("Please enter your OpenAI API key to continue.")
             return
 
     # Initialize session state
     if 'session' not in st.session_state:
         st.session_state.session = 1
+        st.session_state.fingerprints = {}
+        # A report link (?job=...) picks up its job again, e.g. after the tab was closed
+        job = get_report_job(st.query_params['job']) if 'job' in st.query_params else None
+        if job is not None:
+            st.session_state.report_job = job['id']
+            for key in ['user_data', 'analysis1', 'analysis2']:
+                st.session_state[key] = job['results'][key]
+            st.session_state.fingerprints = {
+                key: job['fingerprints'][key]
+                for key in ['analysis1', 'analysis2'] if key in job['fingerprints']
+            }
+            st.session_state.session = 3
 
     # Session 1: Initial Assessment
     st.header("1️⃣ Organization Profile & ESG Readiness")
@@ -1162,17 +1909,19 @@ def main():
                     "esg_responses": esg_responses
                 }
                 
+                # Stream the analysis while it is generated; it is shown below once complete
+                preview = st.empty()
                 with st.spinner("Generating initial analysis..."):
-                    st.session_state.analysis1 = get_esg_analysis1(
-                        st.session_state.user_data, 
-                        api_key
-                    )
-                    if st.session_state.analysis1:
+                    error = run_session_stage('analysis1', api_key, preview)
+                    preview.empty()
+                    if error:
+                        st.error(f"Error getting initial analysis: {error}")
+                    else:
                         st.session_state.session = 2
 
     # Display Analysis 1 and Session 2
     if hasattr(st.session_state, 'analysis1'):
-        st.markdown(st.session_state.analysis1)
+        st.markdown(result_markdown(st.session_state.analysis1))
     
     if st.session_state.session >= 2:
         st.header("2️⃣ Framework Selection")
@@ -1202,143 +1951,93 @@ def main():
                     other_frameworks = [f for f in other_frameworks if f.strip()]
                     st.session_state.user_data["other_frameworks"] = other_frameworks
                 
+                preview = st.empty()
                 with st.spinner("Generating framework analysis..."):
-                    st.session_state.analysis2 = get_esg_analysis2(
-                        st.session_state.user_data,
-                        api_key
-                    )
-                    if st.session_state.analysis2:
+                    error = run_session_stage('analysis2', api_key, preview)
+                    preview.empty()
+                    if error:
+                        st.error(f"Error getting ESG analysis: {error}")
+                    else:
                         st.session_state.session = 3
 
-    # Display Analysis 2 and Generate Management Questions
+    # Display Analysis 2 and generate the remaining report sections
     if hasattr(st.session_state, 'analysis2'):
-        st.markdown(st.session_state.analysis2)
+        st.markdown(result_markdown(st.session_state.analysis2))
         
         if st.session_state.session >= 3:
-            st.header("3️⃣ Management Issues")
+            # The remaining sections and the PDF are generated by a background job
+            fingerprints = st.session_state.fingerprints
+            results = session_results()
+            job = get_report_job(st.session_state.report_job) if 'report_job' in st.session_state else None
+            # A job started before the profile or the analyses were edited no longer applies
+            if job is not None and any(job['results'].get(key) != results.get(key)
+                                       for key in ['user_data', 'analysis1', 'analysis2']):
+                job = None
             
-            if 'management_questions' not in st.session_state:
-                with st.spinner("Generating management issues..."):
-                    st.session_state.management_questions = generate_management_questions(
-                        st.session_state.analysis1,
-                        st.session_state.analysis2,
-                        api_key
-                    )
+            if job is not None:
+                for _, key in REPORT_SECTIONS:
+                    if stage_is_current(key, job['results'], job['fingerprints']):
+                        st.session_state[key] = job['results'][key]
+                        fingerprints[key] = job['fingerprints'][key]
+                results = session_results()
             
-            if hasattr(st.session_state, 'management_questions'):
-                st.markdown(st.session_state.management_questions)
-                
-                # Session 4: Question Rationale
-                st.header("4️⃣ Issue Rationale")
-                
-                if 'question_rationale' not in st.session_state:
-                    with st.spinner("Generating rationale..."):
-                        st.session_state.question_rationale = generate_question_rationale(
-                            st.session_state.management_questions,
-                            st.session_state.analysis1,
-                            st.session_state.analysis2,
-                            api_key
-                        )
-                
-                if hasattr(st.session_state, 'question_rationale'):
-                    st.markdown(st.session_state.question_rationale)
-                    
-                    # Session 5: Implementation Challenges
-                    st.header("5️⃣ Implementation Challenges")
-                    
-                    if 'implementation_challenges' not in st.session_state:
-                        with st.spinner("Analyzing implementation challenges..."):
-                            st.session_state.implementation_challenges = generate_implementation_challenges(
-                                st.session_state.analysis1,
-                                st.session_state.analysis2,
-                                st.session_state.management_questions,
-                                api_key
-                            )
+            # Only sections whose inputs changed (and those downstream of them) are regenerated
+            stale = [key for _, key in REPORT_SECTIONS if not stage_is_current(key, results, fingerprints)]
+            if job is None and stale:
+                st.session_state.report_job = submit_report_job(
+                    results, api_key, stages=[key for _, key in REPORT_SECTIONS],
+                    fingerprints=fingerprints
+                )
+                st.query_params['job'] = st.session_state.report_job
+                job = get_report_job(st.session_state.report_job)
+            
+            # Show up-to-date sections and the text streamed so far for sections in progress
+            for header, key in REPORT_SECTIONS:
+                st.header(header)
+                if key not in stale:
+                    st.markdown(result_markdown(st.session_state[key]))
+                elif job is not None and key in job['partial']:
+                    st.markdown(job['partial'][key] + "▌")
+            
+            if job is not None and job['status'] in ('queued', 'running'):
+                if job['status'] == 'queued':
+                    ahead = job_queue_position(job)
+                    message = (f"Waiting for a free worker: {ahead} report{'s' if ahead != 1 else ''} "
+                               f"ahead of yours...")
+                else:
+                    message = "Generating management issues, rationale, challenges, advisory plan and SROI model..."
+                with st.spinner(message):
+                    time.sleep(JOB_POLL_INTERVAL)
+                st.rerun()
+            elif job is not None and job['status'] == 'failed':
+                st.error(f"Error generating report: {job['error']}")
+                if st.button("Retry"):
+                    # A new job only regenerates the sections that are out of date
+                    del st.session_state.report_job
+                    st.rerun()
+            
+            # Offer the PDF once all analyses are complete
+            elif not stale:
+                try:
+                    if job is not None and job['pdf_path'] and os.path.exists(job['pdf_path']):
+                        with open(job['pdf_path'], 'rb') as f:
+                            pdf_data = f.read()
+                    else:
+                        # Built once, then served from the PDF cache on every rerun
+                        from esg_pdf import report_pdf
+                        esg_data, personal_info = build_report_inputs(st.session_state.user_data, st.session_state)
+                        pdf_data = report_pdf(esg_data, personal_info)
                     
-                    if hasattr(st.session_state, 'implementation_challenges'):
-                        st.markdown(st.session_state.implementation_challenges)
-                        
-                        # Session 6: Advisory Plan & SROI Model
-                        st.header("6️⃣ Advisory Plan")
-                        
-                        if 'advisory' not in st.session_state:
-                            all_analyses = {
-                                'analysis1': st.session_state.analysis1,
-                                'analysis2': st.session_state.analysis2,
-                                'management_questions': st.session_state.management_questions,
-                                'question_rationale': st.session_state.question_rationale,
-                                'implementation_challenges': st.session_state.implementation_challenges
-                            }
-                            
-                            with st.spinner("Generating advisory plan..."):
-                                st.session_state.advisory = generate_advisory_analysis(
-                                    st.session_state.user_data,
-                                    all_analyses,
-                                    api_key
-                                )
-                        
-                        if hasattr(st.session_state, 'advisory'):
-                            st.markdown(st.session_state.advisory)
-                        
-                        # Session 7: SROI Model
-                        st.header("7️⃣ SROI Model")
-                        
-                        if 'sroi' not in st.session_state:
-                            all_analyses = {
-                                'analysis1': st.session_state.analysis1,
-                                'analysis2': st.session_state.analysis2,
-                                'management_questions': st.session_state.management_questions,
-                                'question_rationale': st.session_state.question_rationale,
-                                'implementation_challenges': st.session_state.implementation_challenges,
-                                'advisory': st.session_state.advisory
-                            }
-                            
-                            with st.spinner("Generating SROI model..."):
-                                st.session_state.sroi = generate_sroi_analysis(
-                                    st.session_state.user_data,
-                                    all_analyses,
-                                    api_key
-                                )
-                        
-                        if hasattr(st.session_state, 'sroi'):
-                            st.markdown(st.session_state.sroi)
-                            
-                            # Generate PDF only when all analyses are complete
-                            if (hasattr(st.session_state, 'analysis1') and 
-                                hasattr(st.session_state, 'analysis2') and 
-                                hasattr(st.session_state, 'management_questions') and 
-                                hasattr(st.session_state, 'implementation_challenges') and 
-                                hasattr(st.session_state, 'advisory') and 
-                                hasattr(st.session_state, 'sroi')):
-                                try:
-                                    esg_data = {
-                                        'analysis1': st.session_state.analysis1,
-                                        'analysis2': st.session_state.analysis2,
-                                        'management_questions': st.session_state.management_questions,
-                                        'implementation_challenges': st.session_state.implementation_challenges,
-                                        'advisory': st.session_state.advisory,
-                                        'sroi': st.session_state.sroi
-                                    }
-                                    
-                                    personal_info = {
-                                        'organization_name': st.session_state.user_data['organization_name'],
-                                        'sector': st.session_state.user_data['industry'],  # Changed from 'industry' to 'sector' to match PDF template
-                                        'type': ', '.join(st.session_state.user_data['organization_types']),
-                                        'date': datetime.datetime.now().strftime('%B %d, %Y')
-                                    }
-                                    page_numbers = [4, 6, 8, 11, 13, 15] 
-                                    pdf_buffer = generate_pdf(esg_data, personal_info,page_numbers)
-                                    
-                                    # Download button
-                                    st.download_button(
-                                        "📥 Download ESG Assessment Report",
-                                        data=pdf_buffer,
-                                        file_name=f"esg_assessment_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
-                                        mime="application/pdf",
-                                        help="Click to download your ESG assessment report"
-                                    )
-                                except Exception as e:
-                                    st.error(f"Error generating PDF: {str(e)}")
-                                    print(f"Detailed error: {str(e)}")
+                    # Download button
+                    st.download_button(
+                        "📥 Download ESG Assessment Report",
+                        data=pdf_data,
+                        file_name=f"esg_assessment_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+                        mime="application/pdf",
+                        help="Click to download your ESG assessment report"
+                    )
+                except Exception as e:
+                    st.error(f"Error generating PDF: {str(e)}")
+                    print(f"Detailed error: {str(e)}")
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+"""Headless batch generation of ESG assessment reports.
+
+Reads organization profiles from a CSV or JSONL file, runs the full report
+pipeline and PDF build for each one and writes the PDFs to an output
+directory. Rows whose PDF already exists are skipped, so an interrupted
+run can simply be started again.
+
+JSONL rows use the same shape as st.session_state.user_data:
+organization_name, industry, core_activities, esg_responses (question ->
+answer) and organization_types (list).
+
+CSV rows have organization_name, industry, core_activities and
+organization_types (separated by ';') columns, plus one column per
+readiness question, named either by the full question text or q1..q6. An
+answer may be the option text or its number (1-4).
+
+With --bundle, all reports are written to one file instead: a single PDF
+(images and fonts embedded once for all reports) or, for a .zip path, a
+ZIP of the individual PDFs. The single PDF is laid out serially on one CPU;
+only the ZIP builds its PDFs in --bundle-workers processes.
+
+Usage:
+    python batch_reports.py profiles.csv --output-dir reports --concurrency 4
+    python batch_reports.py profiles.csv --bundle reports/group.pdf
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from EsgStarterkitV2 import (
+    ESG_READINESS_QUESTIONS, ORGANIZATION_TYPES, PIPELINE_STAGES,
+    build_report_inputs, describe_failures, record_metric, run_pipeline
+)
+from esg_pdf import BUNDLE_WORKERS, generate_pdf, generate_pdf_bundle, generate_pdf_zip
+
+
+def _parse_answer(question, value):
+    options = ESG_READINESS_QUESTIONS[question]
+    value = (value or '').strip()
+    if value.isdigit() and 1 <= int(value) <= len(options):
+        return options[int(value) - 1]
+    if value not in options:
+        raise ValueError(f"Invalid answer for '{question}': {value!r}")
+    return value
+
+
+def _profile_from_csv_row(row):
+    esg_responses = {}
+    for i, question in enumerate(ESG_READINESS_QUESTIONS, 1):
+        value = row.get(question, row.get(f"q{i}"))
+        esg_responses[question] = _parse_answer(question, value)
+    return {
+        "organization_name": row.get("organization_name", "").strip(),
+        "industry": row.get("industry", "").strip(),
+        "core_activities": row.get("core_activities", "").strip(),
+        "esg_responses": esg_responses,
+        "organization_types": [
+            t.strip() for t in row.get("organization_types", "").split(';') if t.strip()
+        ]
+    }
+
+
+def load_profiles(path):
+    """Load profiles from a .csv or .jsonl file as a list of user_data dicts"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            return [_profile_from_csv_row(row) for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def validate_profile(profile):
+    """Raise ValueError if a profile is missing data the report needs"""
+    for field in ("organization_name", "industry", "core_activities"):
+        if not profile.get(field):
+            raise ValueError(f"Missing {field}")
+    missing = [q for q in ESG_READINESS_QUESTIONS if not profile.get("esg_responses", {}).get(q)]
+    if missing:
+        raise ValueError(f"Missing answers for {len(missing)} readiness questions")
+    if not profile.get("organization_types"):
+        raise ValueError("Missing organization_types")
+    unknown = [t for t in profile["organization_types"] if t not in ORGANIZATION_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown organization types: {', '.join(unknown)}")
+
+
+def report_path(output_dir, index, profile):
+    """Stable output path for a profile row"""
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', profile.get("organization_name", "")).strip('-').lower()
+    return os.path.join(output_dir, f"{index:04d}-{slug or 'organization'}.pdf")
+
+
+def report_inputs(profile, api_key, report_id):
+    """Run the full pipeline for one profile and return its (esg_data, personal_info)"""
+    validate_profile(profile)
+    errors = {}
+    results = run_pipeline({'user_data': profile}, api_key, errors=errors, report_id=report_id)
+    failed = [stage for stage in PIPELINE_STAGES if results.get(stage) is None]
+    if failed:
+        raise RuntimeError(describe_failures(failed, errors))
+    return build_report_inputs(profile, results)
+
+
+def _write_atomically(path, data):
+    # An interrupted run never leaves a partial file behind
+    tmp_path = path + ".part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def generate_report(profile, api_key, path):
+    """Run the full pipeline for one profile and write its PDF to path"""
+    report_id = os.path.basename(path)
+    esg_data, personal_info = report_inputs(profile, api_key, report_id)
+    start = time.perf_counter()
+    pdf_buffer = generate_pdf(esg_data, personal_info)
+    record_metric('pdf_build', report=report_id, seconds=time.perf_counter() - start,
+                  bytes=pdf_buffer.getbuffer().nbytes)
+    _write_atomically(path, pdf_buffer.getvalue())
+
+
+def run_batch(profiles, api_key, output_dir, concurrency=4):
+    """Generate reports for all profiles, skipping those already written.
+
+    Returns a list of (index, error message) for the profiles that failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    todo = []
+    for index, profile in enumerate(profiles, 1):
+        path = report_path(output_dir, index, profile)
+        if os.path.exists(path):
+            print(f"[{index}] skipped, {path} already exists")
+        else:
+            todo.append((index, profile, path))
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(generate_report, profile, api_key, path): (index, path)
+            for index, profile, path in todo
+        }
+        for future in as_completed(futures):
+            index, path = futures[future]
+            try:
+                future.result()
+                print(f"[{index}] wrote {path}")
+            except Exception as e:
+                failures.append((index, str(e)))
+                print(f"[{index}] failed: {e}", file=sys.stderr)
+    return failures
+
+
+def run_bundle(profiles, api_key, bundle_path, concurrency=4, workers=BUNDLE_WORKERS):
+    """Generate reports for all profiles and write them to one bundle file.
+
+    bundle_path ending in .zip gets a ZIP of the individual PDFs, any other
+    path a single PDF with all reports. workers processes build the PDFs of
+    a ZIP; the single PDF is built serially. Completions are cached, so running
+    a bundle again after a failure only regenerates what is missing.
+    Returns a list of (index, error message) for the profiles left out.
+    """
+    names = [os.path.basename(report_path('', index, profile))
+             for index, profile in enumerate(profiles, 1)]
+    inputs = {}
+    failures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(report_inputs, profile, api_key, names[index - 1]): index
+            for index, profile in enumerate(profiles, 1)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                inputs[index] = future.result()
+                print(f"[{index}] generated")
+            except Exception as e:
+                failures.append((index, str(e)))
+                print(f"[{index}] failed: {e}", file=sys.stderr)
+
+    if inputs:
+        indexes = sorted(inputs)
+        reports = [inputs[index] for index in indexes]
+        start = time.perf_counter()
+        if bundle_path.lower().endswith('.zip'):
+            buffer = generate_pdf_zip(reports, [names[index - 1] for index in indexes], workers)
+        else:
+            buffer = generate_pdf_bundle(reports)
+        record_metric('pdf_bundle', bundle=os.path.basename(bundle_path), reports=len(reports),
+                      seconds=time.perf_counter() - start, bytes=buffer.getbuffer().nbytes)
+        os.makedirs(os.path.dirname(bundle_path) or '.', exist_ok=True)
+        _write_atomically(bundle_path, buffer.getvalue())
+        print(f"wrote {len(reports)} reports to {bundle_path}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate ESG assessment reports in bulk")
+    parser.add_argument("profiles", help="CSV or JSONL file of organization profiles")
+    parser.add_argument("--output-dir", default="reports", help="Directory for the PDFs")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Number of reports generated at the same time")
+    parser.add_argument("--bundle", metavar="PATH",
+                        help="Write all reports to one PDF, or to a ZIP of PDFs if PATH ends in .zip. "
+                             "The one PDF is built serially, on a single CPU")
+    parser.add_argument("--bundle-workers", type=int, default=BUNDLE_WORKERS,
+                        help="Processes used to build the PDFs of a .zip bundle "
+                             "(a single-PDF bundle is always serial)")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="OpenAI API key (defaults to $OPENAI_API_KEY)")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("an OpenAI API key is required (--api-key or $OPENAI_API_KEY)")
+
+    profiles = load_profiles(args.profiles)
+    if args.bundle:
+        failures = run_bundle(profiles, args.api_key, args.bundle, args.concurrency,
+                              args.bundle_workers)
+        print(f"{len(profiles) - len(failures)} of {len(profiles)} reports in {args.bundle}")
+        return 1 if failures else 0
+    failures = run_batch(profiles, args.api_key, args.output_dir, args.concurrency)
+    print(f"{len(profiles) - len(failures)} of {len(profiles)} reports available in {args.output_dir}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
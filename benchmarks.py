@@ -0,0 +1,496 @@
+"""Benchmarks for report generation.
+
+Run from the repository root so the report images are found:
+
+    python benchmarks.py toc [--repeat 5] [--words 1500]
+    python benchmarks.py canvas [--repeat 3] [--words 1500]
+    python benchmarks.py reports [--concurrency 1 10 100] [--latency 0.5] [--words 600]
+    python benchmarks.py markdown [--repeat 5] [--words 50000]
+    python benchmarks.py bundle [--reports 50] [--words 800] [--workers N]
+    python benchmarks.py startup [--repeat 5] [--reruns 5]
+    python benchmarks.py prompt-cache [--backend openai --api-key KEY]
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.platypus import PageBreak, Spacer
+
+import EsgStarterkitV2 as esg
+import esg_pdf
+
+def sample_report(words, seed=0):
+    """esg_data and personal_info for a report whose sections have ~`words` words each"""
+    esg_data = {
+        key: esg.fake_markdown(words, seed * len(esg_pdf.PDF_SECTIONS) + i)
+        for i, key in enumerate(['analysis1', 'analysis2', 'management_questions',
+                                    'implementation_challenges', 'advisory', 'sroi'])
+    }
+    personal_info = {
+        'organization_name': "Benchmark Sdn Bhd",
+        'sector': "Energy and Utilities",
+        'type': "Public Listed Company",
+        'date': "January 01, 2025"
+    }
+    return esg_data, personal_info
+
+
+def timeit(fn, repeat):
+    """Wall times of `repeat` calls of fn, after one warm-up call"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class DryRunCanvas(esg_pdf.NumberedCanvas):
+    """The previous canvas for measuring TOC page numbers: pages are counted but never rendered"""
+    def drawImage(self, *args, **kwargs):
+        pass
+
+    def drawInlineImage(self, *args, **kwargs):
+        pass
+
+    def showPage(self):
+        self._pageNumber += 1
+        self._startPage()
+
+    def save(self):
+        pass
+
+
+def _build_with_dry_run(esg_data, personal_info):
+    """The previous generate_pdf: a dry-run layout pass for the TOC, then the build"""
+    elements = esg_pdf._report_builder(esg_data).story(personal_info)
+    doc = esg_pdf.create_pdf_doc(io.BytesIO())
+    edits = []
+    doc._multiBuildEdits = edits.append
+    doc.build(elements[:], canvasmaker=DryRunCanvas)
+    for edit in edits:
+        edit[0](*edit[1:])
+    buffer = io.BytesIO()
+    esg_pdf.create_pdf_doc(buffer).build(elements, canvasmaker=esg_pdf.NumberedCanvas)
+    return buffer
+
+
+def bench_toc(args):
+    """PDF build with deferred TOC page numbers vs. dry-run measurement plus build"""
+    esg_data, personal_info = sample_report(args.words)
+    single = timeit(lambda: esg_pdf.generate_pdf(esg_data, personal_info), args.repeat)
+    two_pass = timeit(lambda: _build_with_dry_run(esg_data, personal_info), args.repeat)
+
+    print(f"Report with sections of ~{args.words} words, {args.repeat} runs each")
+    print(f"{'build':<28}{'median (s)':>12}{'min (s)':>12}")
+    print(f"{'deferred forms (current)':<28}{statistics.median(single):>12.3f}{min(single):>12.3f}")
+    print(f"{'dry run + build (previous)':<28}{statistics.median(two_pass):>12.3f}{min(two_pass):>12.3f}")
+    saving = 1 - statistics.median(single) / statistics.median(two_pass)
+    print(f"Time saved by dropping the dry run: {saving:.1%}")
+
+
+class SnapshotNumberedCanvas(canvas.Canvas):
+    """The previous NumberedCanvas, which kept a copy of every page's state until save()"""
+    def __init__(self, *args, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self._saved_page_states = []
+        # TOC page numbers are left blank; they are not what this compares
+        self.setNamedCB('section_page', lambda *args: None)
+
+    def mark_section(self, title):
+        pass
+
+    def showPage(self):
+        self._saved_page_states.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        for state in self._saved_page_states:
+            self.__dict__.update(state)
+            canvas.Canvas.showPage(self)
+        canvas.Canvas.save(self)
+
+    def draw_page_number(self, x, y):
+        self.drawRightString(x, y, f"Page {self._pageNumber}")
+
+
+def _build_with_canvas(canvasmaker, esg_data, personal_info, held=None):
+    original = esg_pdf.NumberedCanvas
+    if held is not None:
+        # Record the traced memory still allocated when the document is saved
+        class canvasmaker(canvasmaker):
+            def save(self):
+                held.append(tracemalloc.get_traced_memory()[0])
+                super().save()
+    esg_pdf.NumberedCanvas = canvasmaker
+    try:
+        return esg_pdf.generate_pdf(esg_data, personal_info)
+    finally:
+        esg_pdf.NumberedCanvas = original
+
+
+def bench_canvas(args):
+    """Memory and time of a PDF build with the snapshot and the form-based page numbering.
+
+    "at save()" is the traced memory still allocated when the canvas is
+    saved, i.e. what the canvas holds on to for the whole build.
+    """
+    esg_data, personal_info = sample_report(args.words)
+    print(f"{'canvas':<28}{'pages':>8}{'at save() MiB':>16}{'peak MiB':>12}{'median (s)':>12}")
+    for name, canvasmaker in [("snapshot (previous)", SnapshotNumberedCanvas),
+                              ("form XObject (current)", esg_pdf.NumberedCanvas)]:
+        times = timeit(lambda: _build_with_canvas(canvasmaker, esg_data, personal_info), args.repeat)
+        # Memory is measured on a separate build since tracing slows it down
+        held = []
+        tracemalloc.start()
+        pdf = _build_with_canvas(canvasmaker, esg_data, personal_info, held)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pages = pdf.getvalue().count(b"/Type /Page\n")
+        print(f"{name:<28}{pages:>8}{held[0] / 2**20:>16.2f}{peak / 2**20:>12.2f}"
+              f"{statistics.median(times):>12.3f}")
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values"""
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+_profile_ids = itertools.count()
+
+
+def _sample_profile(index):
+    question_answers = {
+        question: options[index % len(options)]
+        for question, options in esg.ESG_READINESS_QUESTIONS.items()
+    }
+    return {
+        "organization_name": f"Benchmark Organization {index}",
+        "industry": esg.FIELDS_OF_INDUSTRY[index % len(esg.FIELDS_OF_INDUSTRY)],
+        "core_activities": "Manufacturing and distribution of consumer goods",
+        "esg_responses": question_answers,
+        "organization_types": [esg.ORGANIZATION_TYPES[index % len(esg.ORGANIZATION_TYPES)]]
+    }
+
+
+def _timed(name, fn, timings, lock):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with lock:
+                timings.setdefault(name, []).append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_reports(count, timings):
+    """Submit `count` report jobs at once on the fake backend and wait for all of them.
+
+    Appends per-stage, PDF, queue wait and end-to-end times to `timings`.
+    """
+    lock = threading.Lock()
+    submitted = {}
+    finished = threading.Semaphore(0)
+    run_job = esg._run_report_job
+
+    def timed_job(job_id, *args):
+        start = time.perf_counter()
+        try:
+            run_job(job_id, *args)
+        finally:
+            end = time.perf_counter()
+            with lock:
+                timings.setdefault("queue wait", []).append(start - submitted[job_id])
+                timings.setdefault("end to end", []).append(end - submitted[job_id])
+            finished.release()
+
+    esg._run_report_job = timed_job
+    try:
+        job_ids = []
+        for _ in range(count):
+            # Every report has its own profile, so no completion is served from the cache
+            results = {'user_data': _sample_profile(next(_profile_ids))}
+            with lock:
+                # Taken before submitting, as a worker may pick the job up straight away
+                submit_time = time.perf_counter()
+                job_id = esg.submit_report_job(results, api_key="benchmark")
+                submitted[job_id] = submit_time
+            job_ids.append(job_id)
+        for _ in job_ids:
+            finished.acquire()
+    finally:
+        esg._run_report_job = run_job
+    failed = [job for job in map(esg.get_report_job, job_ids) if job['status'] != 'done']
+    if failed:
+        raise RuntimeError(f"{len(failed)} reports failed: {failed[0]['error']}")
+
+
+def bench_reports(args):
+    """Stage, PDF and end-to-end latency of concurrent reports on the fake completion backend"""
+    # Isolated cache directory so completions, jobs, images and PDFs start cold
+    esg.CACHE_DIR = esg_pdf.CACHE_DIR = tempfile.mkdtemp(prefix="esg-bench-")
+    esg_pdf.PDF_CACHE_DIR = os.path.join(esg_pdf.CACHE_DIR, "pdf")
+    esg.LLM_BACKEND = 'fake'
+    esg.FAKE_LLM_LATENCY = args.latency
+    esg.FAKE_LLM_WORDS = args.words
+
+    stages = dict(esg.PIPELINE_STAGES)
+    build = esg_pdf.ReportBuilder.build
+    print(f"Fake backend: {args.latency}s and ~{args.words} words per completion, "
+          f"{esg.JOB_WORKERS} job workers, cache dir {esg.CACHE_DIR}")
+    try:
+        run_reports(1, {})  # warm up (print-ready images, fonts)
+        for count in args.concurrency:
+            timings = {}
+            lock = threading.Lock()
+            for stage, spec in stages.items():
+                esg.PIPELINE_STAGES[stage] = dict(spec, run=_timed(stage, spec['run'], timings, lock))
+            esg_pdf.ReportBuilder.build = _timed("pdf build", build, timings, lock)
+            start = time.perf_counter()
+            run_reports(count, timings)
+            elapsed = time.perf_counter() - start
+
+            print(f"\n{count} concurrent reports: {elapsed:.2f}s, {count / elapsed * 60:.1f} reports/min")
+            print(f"{'':<28}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+            for name in ["queue wait", *stages, "pdf build", "end to end"]:
+                values = timings.get(name, [])
+                if values:
+                    print(f"{name:<28}{percentile(values, 50):>10.3f}"
+                          f"{percentile(values, 95):>10.3f}{max(values):>10.3f}")
+    finally:
+        esg.PIPELINE_STAGES.update(stages)
+        esg_pdf.ReportBuilder.build = build
+
+
+def legacy_clean_text(text):
+    """The previous clean_text, which stripped all markdown from a line"""
+    if not text:
+        return ""
+    text = re.sub(r'#{1,6}\s?', '', text)  # Remove markdown headers
+    text = re.sub(r'[\*_`]', '', text)      # Remove markdown formatting
+    text = re.sub(r'\.{2,}', '.', text)     # Clean up multiple periods
+    return ' '.join(text.split()).strip()
+
+
+def legacy_process_content(content, styles, elements):
+    """The previous process_content: per-line regex passes and substring checks"""
+    if not content:
+        return
+    for para in content.strip().split('\n'):
+        clean_para = legacy_clean_text(para)
+        if not clean_para:
+            continue
+        if "Summary" in clean_para:
+            elements.append(esg_pdf.LayoutCachedParagraph(clean_para, styles['subheading']))
+            continue
+        if "Strengths and Advantages" in clean_para:
+            elements.append(esg_pdf.LayoutCachedParagraph(clean_para, styles['subheading']))
+            continue
+        if "Skills and Competencies" in clean_para:
+            elements.append(esg_pdf.LayoutCachedParagraph(clean_para, styles['subheading']))
+            continue
+        if "Compatible Personality and Behavioral Insights" in clean_para:
+            elements.append(PageBreak())
+            elements.append(esg_pdf.LayoutCachedParagraph(clean_para, styles['subheading']))
+            continue
+        point_match = re.match(r'^\d+\.?\s+(.+)', clean_para)
+        if point_match:
+            elements.extend([
+                Spacer(1, 0.1*inch),
+                esg_pdf.create_highlight_box(point_match.group(1), styles),
+                Spacer(1, 0.1*inch)
+            ])
+        elif clean_para.startswith(('•', '-', '*')):
+            elements.append(esg_pdf.LayoutCachedParagraph(f"• {clean_para.lstrip('•-* ')}", styles['bullet']))
+        else:
+            elements.append(esg_pdf.LayoutCachedParagraph(clean_para, styles['content']))
+            elements.append(Spacer(1, 0.05*inch))
+
+
+def legacy_parse(content):
+    """The text handling of the previous process_content, without building flowables"""
+    parsed = []
+    for para in content.strip().split('\n'):
+        clean_para = legacy_clean_text(para)
+        if not clean_para:
+            continue
+        if ("Summary" in clean_para or "Strengths and Advantages" in clean_para
+                or "Skills and Competencies" in clean_para
+                or "Compatible Personality and Behavioral Insights" in clean_para):
+            parsed.append(('heading', clean_para))
+            continue
+        point_match = re.match(r'^\d+\.?\s+(.+)', clean_para)
+        if point_match:
+            parsed.append(('point', point_match.group(1)))
+        elif clean_para.startswith(('•', '-', '*')):
+            parsed.append(('bullet', clean_para.lstrip('•-* ')))
+        else:
+            parsed.append(('paragraph', clean_para))
+    return parsed
+
+
+def bench_markdown(args):
+    """Markdown-to-flowables conversion: previous process_content vs. the single-pass converter"""
+    content = esg.fake_markdown(args.words)
+    styles = esg_pdf.create_custom_styles()
+    print(f"{len(content.splitlines())} lines, ~{args.words} words, {args.repeat} runs each")
+    print(f"{'text parsing':<28}{'lines':>10}{'median (ms)':>14}{'min (ms)':>12}")
+    for name, parse in [("per-line regex (previous)", legacy_parse),
+                        ("single pass (current)", lambda text: list(esg_pdf.parse_markdown(text)))]:
+        times = timeit(lambda: parse(content), args.repeat)
+        print(f"{name:<28}{len(parse(content)):>10}{statistics.median(times) * 1000:>14.1f}"
+              f"{min(times) * 1000:>12.1f}")
+
+    # Building the flowables includes ReportLab's paragraph markup parser,
+    # which now also parses the <b>/<i> tags the previous version dropped
+    print(f"\n{'text to flowables':<28}{'flowables':>10}{'median (ms)':>14}{'min (ms)':>12}")
+    for name, process in [("per-line regex (previous)", legacy_process_content),
+                          ("single pass (current)", esg_pdf.process_content)]:
+        elements = []
+        process(content, styles, elements)
+        times = timeit(lambda: process(content, styles, []), args.repeat)
+        print(f"{name:<28}{len(elements):>10}{statistics.median(times) * 1000:>14.1f}"
+              f"{min(times) * 1000:>12.1f}")
+
+
+def bench_bundle(args):
+    """Bundle of many reports vs. building each report as a separate PDF"""
+    reports = [sample_report(args.words, seed) for seed in range(args.reports)]
+    print(f"{args.reports} reports, ~{args.words} words per section, "
+          f"{args.workers} worker processes for the ZIP (the bundled PDF is serial)")
+    print(f"{'build':<28}{'seconds':>10}{'MB':>10}")
+
+    start = time.perf_counter()
+    size = sum(esg_pdf.generate_pdf(*report).getbuffer().nbytes for report in reports)
+    single = time.perf_counter() - start
+    print(f"{'separate PDFs, one by one':<28}{single:>10.1f}{size / 1e6:>10.1f}")
+
+    names = [f"{i:04d}.pdf" for i in range(1, args.reports + 1)]
+    for name, build in [("ZIP of PDFs", lambda: esg_pdf.generate_pdf_zip(reports, names, args.workers)),
+                        ("one bundled PDF", lambda: esg_pdf.generate_pdf_bundle(reports))]:
+        start = time.perf_counter()
+        size = build().getbuffer().nbytes
+        print(f"{name:<28}{time.perf_counter() - start:>10.1f}{size / 1e6:>10.1f}")
+
+
+def bench_prompt_cache(args):
+    """Prompt tokens served from the provider's prefix cache, per stage of one report"""
+    esg.CACHE_DIR = esg_pdf.CACHE_DIR = tempfile.mkdtemp(prefix="esg-bench-")
+    esg.LLM_BACKEND = args.backend
+    esg.FAKE_LLM_LATENCY = 0
+    esg.BASELINES_ENABLED = False
+    if args.backend == 'openai' and not args.api_key:
+        sys.exit("an OpenAI API key is required (--api-key or $OPENAI_API_KEY)")
+    esg.run_pipeline({'user_data': _sample_profile(next(_profile_ids))}, args.api_key, errors={})
+
+    print(f"{'stage':<28}{'model':<22}{'prompt':>8}{'cached':>8}")
+    total = cached = 0
+    with open(os.path.join(esg.CACHE_DIR, "metrics.jsonl"), encoding='utf-8') as f:
+        for event in map(json.loads, f):
+            if event['event'] != 'stage' or event.get('prompt_tokens') is None:
+                continue
+            total += event['prompt_tokens']
+            cached += event.get('cached_tokens') or 0
+            print(f"{event['stage']:<28}{event['model']:<22}{event['prompt_tokens']:>8}"
+                  f"{event.get('cached_tokens') or 0:>8}")
+    print(f"{'total':<50}{total:>8}{cached:>8}  ({cached / max(total, 1):.0%} cached)")
+
+
+# Run in a new interpreter with streamlit already imported, as in a server
+# process that has just started: times each run of the app script
+STARTUP_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=60)
+times = []
+for _ in range(int(sys.argv[2])):
+    start = time.perf_counter()
+    app.run()
+    times.append(time.perf_counter() - start)
+print(json.dumps(times))
+"""
+
+
+def bench_startup(args):
+    """Time to first render of the page in a new process (cold) and on reruns (warm)"""
+    cold, warm = [], []
+    for _ in range(args.repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, "EsgStarterkitV2.py", str(args.reruns + 1)],
+            capture_output=True, text=True, check=True
+        )
+        times = json.loads(result.stdout.strip().splitlines()[-1])
+        cold.append(times[0])
+        warm.extend(times[1:])
+    print(f"{'first render':<16}{'runs':>6}{'median (ms)':>14}{'max (ms)':>12}")
+    for name, times in [("cold", cold), ("warm rerun", warm)]:
+        print(f"{name:<16}{len(times):>6}{statistics.median(times) * 1000:>14.1f}"
+              f"{max(times) * 1000:>12.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ESG report generation benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    toc = subparsers.add_parser("toc", help="deferred TOC page numbers vs. the previous dry-run pass")
+    toc.add_argument("--repeat", type=int, default=5)
+    toc.add_argument("--words", type=int, default=1500, help="words per report section")
+    toc.set_defaults(func=bench_toc)
+
+    canvas_parser = subparsers.add_parser("canvas", help="memory used by page numbering")
+    canvas_parser.add_argument("--repeat", type=int, default=3)
+    canvas_parser.add_argument("--words", type=int, default=1500, help="words per report section")
+    canvas_parser.set_defaults(func=bench_canvas)
+
+    reports = subparsers.add_parser("reports", help="end-to-end latency of concurrent reports")
+    reports.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100],
+                         help="numbers of reports submitted at the same time")
+    reports.add_argument("--latency", type=float, default=0.5, help="simulated seconds per completion")
+    reports.add_argument("--words", type=int, default=600, help="words per completion")
+    reports.set_defaults(func=bench_reports)
+
+    markdown = subparsers.add_parser("markdown", help="markdown to flowables conversion")
+    markdown.add_argument("--repeat", type=int, default=5)
+    markdown.add_argument("--words", type=int, default=50000, help="words of markdown")
+    markdown.set_defaults(func=bench_markdown)
+
+    bundle = subparsers.add_parser("bundle", help="many reports as one serially built PDF or a ZIP")
+    bundle.add_argument("--reports", type=int, default=50)
+    bundle.add_argument("--words", type=int, default=800, help="words per report section")
+    bundle.add_argument("--workers", type=int, default=esg_pdf.BUNDLE_WORKERS,
+                        help="processes used to build the ZIP (the bundled PDF is serial)")
+    bundle.set_defaults(func=bench_bundle)
+
+    prompt_cache = subparsers.add_parser("prompt-cache", help="provider prompt cache hits of one report")
+    prompt_cache.add_argument("--backend", choices=sorted(esg.COMPLETION_BACKENDS), default="fake",
+                              help="the fake backend simulates OpenAI's prefix cache")
+    prompt_cache.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                              help="OpenAI API key (defaults to $OPENAI_API_KEY)")
+    prompt_cache.set_defaults(func=bench_prompt_cache)
+
+    startup = subparsers.add_parser("startup", help="time to first render of the Streamlit page")
+    startup.add_argument("--repeat", type=int, default=5, help="new processes started")
+    startup.add_argument("--reruns", type=int, default=5, help="reruns timed in each process")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1155 @@
+"""PDF rendering of ESG assessment reports with ReportLab.
+
+Kept apart from the Streamlit app so ReportLab is only imported once a
+report is actually built; the module then stays loaded across reruns.
+"""
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import streamlit as st
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from reportlab.platypus import (
+    SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle, Image,
+    NextPageTemplate, PageTemplate, Frame, Flowable
+)
+
+# Shared with the app's completion and job stores
+CACHE_DIR = os.environ.get("ESG_CACHE_DIR", ".esg_cache")
+
+# PDF assets: fonts are registered and header logos decoded once per
+# process, then shared by every page of every report.
+LATO_FONTS = {
+    'Lato': 'fonts/Lato-Regular.ttf',
+    'Lato-Bold': 'fonts/Lato-Bold.ttf',
+    'Lato-Italic': 'fonts/Lato-Italic.ttf',
+    'Lato-BoldItalic': 'fonts/Lato-BoldItalic.ttf'
+}
+HEADER_LOGOS = ["ceai.png", "raa.png", "emma.png"]
+HEADER_LOGO_PIXELS = 150  # Logos print at 0.5 inch, so 300 DPI
+
+# Write PDF streams as binary instead of ASCII85 text: a quarter smaller and
+# faster to build
+rl_config.useA85 = 0
+
+@st.cache_resource
+def load_pdf_assets():
+    """Register fonts and decode header logos once, kept across reports and reruns"""
+    try:
+        for name, path in LATO_FONTS.items():
+            if name not in pdfmetrics.getRegisteredFontNames():
+                pdfmetrics.registerFont(TTFont(name, path))
+        # Lets <b> and <i> markup in paragraphs pick the matching Lato face
+        pdfmetrics.registerFontFamily(
+            'Lato', normal='Lato', bold='Lato-Bold',
+            italic='Lato-Italic', boldItalic='Lato-BoldItalic'
+        )
+        fonts = {'base': 'Lato', 'bold': 'Lato-Bold'}
+    except Exception:
+        # Fallback to Helvetica if Lato fonts are not available
+        fonts = {'base': 'Helvetica', 'bold': 'Helvetica-Bold'}
+
+    # Logos are shrunk to print size: canvas.drawImage hashes an ImageReader's
+    # pixel data on every page to find the already embedded copy
+    from PIL import Image as PILImage
+    logos = {}
+    for path in HEADER_LOGOS:
+        if os.path.exists(path):
+            img = PILImage.open(path)
+            img.thumbnail((HEADER_LOGO_PIXELS, HEADER_LOGO_PIXELS), PILImage.LANCZOS)
+            logo = ImageReader(img)
+            logo.getRGBData()  # Decode now so pages only reuse the pixel data
+            logos[path] = logo
+    return {'fonts': fonts, 'logos': logos}
+
+class PDFWithTOC(SimpleDocTemplate):
+    def __init__(self, *args, **kwargs):
+        SimpleDocTemplate.__init__(self, *args, **kwargs)
+        self.page_numbers = {}
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, Paragraph):
+            style = flowable.style.name
+            if style == 'CustomHeading':  # styles['heading'] from create_custom_styles
+                text = flowable.getPlainText()
+                self.page_numbers[text] = self.page
+                self.canv.mark_section(text)
+
+class LayoutCachedParagraph(Paragraph):
+    """Paragraph that keeps its line breaks between layout passes at the same width.
+
+    Used for report content so ReportBuilder does the expensive line breaking
+    in its background thread and the build reuses it.
+    """
+    def breakLines(self, width):
+        key = tuple(width) if isinstance(width, (list, tuple)) else width
+        if getattr(self, '_cached_breaks_key', None) != key:
+            self._cached_breaks = Paragraph.breakLines(self, width)
+            self._cached_breaks_key = key
+        return self._cached_breaks
+
+class NumberedCanvas(canvas.Canvas):
+    """Canvas that writes "Page X of Y" without keeping any per-page state.
+
+    Each page references a form XObject for the page total, and the form is
+    only drawn when the document is saved and the total is known. In a
+    bundle of reports, numbering restarts at every start_report() call and
+    each report gets its own total.
+
+    Table of contents page numbers work the same way: a TOC entry draws the
+    form of its section (see toc_page_number), mark_section() records the
+    page the section heading lands on, and save() fills in the forms.
+    """
+    PAGE_TOTAL_FORM = 'pageTotal'
+    SECTION_PAGE_FORM = 'sectionPage'
+
+    def __init__(self, *args, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self._report_first_page = 1
+        self._report_totals = []  # (form name, page count) of the finished reports
+        self._section_forms = {}  # (report, section title): form name
+        self._section_pages = {}  # form name: page within its report
+        self._section_page_fonts = {}  # form name: (font name, size) of the TOC entry
+        self.setNamedCB('section_page', self._draw_section_page)
+
+    def _page_total_form(self):
+        return f"{self.PAGE_TOTAL_FORM}{len(self._report_totals) or ''}"
+
+    def start_report(self):
+        """Number pages from the current one as page 1 of a new report"""
+        if self._pageNumber > self._report_first_page:
+            self._report_totals.append(
+                (self._page_total_form(), self._pageNumber - self._report_first_page)
+            )
+            self._report_first_page = self._pageNumber
+
+    def _section_form(self, title):
+        key = (len(self._report_totals), title)
+        if key not in self._section_forms:
+            self._section_forms[key] = f"{self.SECTION_PAGE_FORM}{len(self._section_forms)}"
+        return self._section_forms[key]
+
+    def mark_section(self, title):
+        """Record the current page as the page of the section heading title"""
+        self._section_pages.setdefault(
+            self._section_form(title), self._pageNumber - self._report_first_page + 1
+        )
+
+    def _draw_section_page(self, canv, kind, title):
+        # <onDraw> callback of a TOC entry: the form goes a space after the
+        # end of the text, as line breaking drops the trailing space
+        info = self._curr_tx_info
+        form = self._section_form(title)
+        font_name, font_size = info['tx']._fontname, info['tx']._fontsize
+        self._section_page_fonts[form] = (font_name, font_size)
+        self.saveState()
+        self.translate(info['cur_x'] + self.stringWidth(' ', font_name, font_size), info['cur_y'])
+        self.doForm(form)
+        self.restoreState()
+
+    def draw_page_number(self, x, y):
+        """Draw "Page X of Y" right-aligned at (x, y) in the current font"""
+        font_name, font_size = self._fontname, self._fontsize
+        self._page_total_font = (font_name, font_size)
+        page = self._pageNumber - self._report_first_page + 1
+        # Room for the total, which has at least as many digits as this page number
+        total_width = self.stringWidth('0' * max(2, len(str(page))), font_name, font_size)
+        self.drawRightString(x - total_width, y, f"Page {page} of ")
+        self.saveState()
+        self.translate(x - total_width, y)
+        self.doForm(self._page_total_form())
+        self.restoreState()
+
+    def save(self):
+        if self._code:
+            self.showPage()
+        if hasattr(self, '_page_total_font'):
+            font_name, font_size = self._page_total_font
+            self.start_report()  # Close the last report
+            for form, total in self._report_totals:
+                total_width = self.stringWidth('0' * max(2, len(str(total))), font_name, font_size)
+                self.beginForm(form)
+                self.setFont(font_name, font_size)
+                self.drawRightString(total_width, 0, str(total))
+                self.endForm()
+        for form, (font_name, font_size) in self._section_page_fonts.items():
+            self.beginForm(form)
+            self.setFont(font_name, font_size)
+            self.drawString(0, 0, str(self._section_pages.get(form, '')))
+            self.endForm()
+        canvas.Canvas.save(self)
+
+def toc_page_number(title):
+    """Paragraph markup for the page of section title, drawn by NumberedCanvas"""
+    label = escape(title, {'"': '&quot;'})
+    return f'<onDraw name="section_page" label="{label}"/>'
+
+def create_pdf_doc(target):
+    """Report document with the cover, content and disclaimer page templates"""
+    doc = PDFWithTOC(
+        target,
+        pagesize=letter,
+        rightMargin=inch,
+        leftMargin=inch,
+        topMargin=1.5*inch,
+        bottomMargin=inch
+    )
+    
+    full_page_frame = Frame(
+        0, 0, letter[0], letter[1],
+        leftPadding=0, rightPadding=0,
+        topPadding=0, bottomPadding=0
+    )
+    
+    normal_frame = Frame(
+        doc.leftMargin,
+        doc.bottomMargin,
+        doc.width,
+        doc.height,
+        id='normal'
+    )
+    
+    disclaimer_frame = Frame(
+        doc.leftMargin,
+        doc.bottomMargin,
+        doc.width,
+        doc.height,
+        id='disclaimer'
+    )
+    
+    templates = [
+        PageTemplate(id='First', frames=[full_page_frame],
+                    onPage=lambda canvas, doc: None),
+        PageTemplate(id='Later', frames=[normal_frame],
+                    onPage=create_header_footer),
+        PageTemplate(id='dis', frames=[normal_frame],
+                    onPage=create_header_footer_disclaimer)
+    ]
+    doc.addPageTemplates(templates)
+    return doc
+
+# Report sections in the PDF, in order: (title, esg_data key)
+PDF_SECTIONS = [
+    ("ESG Initial Assessment", 'analysis1'),
+    ("Framework Analysis", 'analysis2'),
+    ("Management Issues", 'management_questions'),
+    ("Implementation Challenges", 'implementation_challenges'),
+    ("Advisory Plan", 'advisory'),
+    ("SROI Analysis", 'sroi')
+]
+
+class ReportBuilder:
+    """Builds the report PDF from sections prepared as soon as they are available.
+
+    add_section() converts a section's markdown to flowables and lays out
+    its paragraphs in a background thread, so this work overlaps with the
+    generation of later sections. build() then only assembles the prepared
+    flowables and writes the PDF in a single layout pass. A section added
+    again replaces the earlier version.
+    """
+    def __init__(self):
+        self.styles = create_custom_styles()
+        # TOC style with right alignment for page numbers
+        self.styles['toc'] = ParagraphStyle(
+            'TOCEntry',
+            parent=self.styles['normal'],
+            fontSize=12,
+            leading=20,
+            leftIndent=20,
+            rightIndent=30,
+            spaceBefore=10,
+            spaceAfter=10,
+            fontName='Helvetica'
+        )
+        # Space available to content on the report's text pages
+        frame = create_pdf_doc(io.BytesIO()).pageTemplates[1].frames[0]
+        self._frame_size = (frame._getAvailableWidth(), frame._aH)
+        self._sections = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="esg-pdf")
+
+    def add_section(self, key, content):
+        """Start preparing the section stored under key (see PDF_SECTIONS)"""
+        self._sections[key] = self._executor.submit(self._prepare_section, key, content)
+
+    def _prepare_section(self, key, content):
+        title = next(title for title, section_key in PDF_SECTIONS if section_key == key)
+        flowables = [Paragraph(title, self.styles['heading'])]
+        process_content(content, self.styles, flowables)
+        # Line breaking is cached by LayoutCachedParagraph, so the layout
+        # passes in build() reuse this work
+        for flowable in flowables:
+            flowable.wrap(*self._frame_size)
+        return flowables
+
+    def close(self):
+        """Stop the background thread; called by build()"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def build(self, personal_info):
+        """Assemble the prepared sections and return the PDF as a BytesIO buffer"""
+        elements = self.story(personal_info)
+        buffer = io.BytesIO()
+        doc = create_pdf_doc(buffer)
+        doc.build(elements, canvasmaker=NumberedCanvas)
+        buffer.seek(0)
+        return buffer
+
+    def story(self, personal_info):
+        """Return the report's flowables; NumberedCanvas fills in the TOC page numbers"""
+        try:
+            sections = [self._sections[key].result() for _, key in PDF_SECTIONS]
+        finally:
+            self.close()
+        styles = self.styles
+        toc_style = styles['toc']
+        
+        elements = []
+        
+        # Cover page
+        elements.append(NextPageTemplate('First'))
+        cover_image = print_ready_image("frontemma.jpg")
+        if cover_image:
+            img = Image(cover_image, width=letter[0], height=letter[1])
+            elements.append(img)
+        
+        elements.append(NextPageTemplate('Later'))
+        elements.append(PageBreak())
+        elements.append(Paragraph("Table of Contents", styles['heading']))
+        
+        # Format TOC entries with dots and manual page numbers
+        def create_toc_entry(num, title, page_num):
+            title_with_num = f"{num}. {title}"
+            dots = '.' * (50 - len(title_with_num))
+            return f"{title_with_num} {dots} {page_num}"
+
+        # First add the static Executive Summary entry
+        static_entry = create_toc_entry(1, "Profile Analysis", 3)  # 3 is the page number
+        elements.append(Paragraph(static_entry, toc_style))
+
+        # Then continue with the dynamic entries, starting from number 2. Page
+        # numbers are only known once the sections are laid out.
+        for i, (title, _) in enumerate(PDF_SECTIONS, 2):
+            elements.append(Paragraph(create_toc_entry(i, title, toc_page_number(title)), toc_style))
+        
+        elements.append(PageBreak())
+        
+        # Content pages
+        elements.extend(create_second_page(styles, personal_info))
+        elements.append(PageBreak())
+        
+        # Main content
+        for i, flowables in enumerate(sections):
+            elements.extend(flowables)
+            if i < len(sections) - 1:
+                elements.append(PageBreak())
+        
+        # Disclaimer
+        elements.append(NextPageTemplate('dis'))
+        elements.append(PageBreak())
+        create_disclaimer_page(styles, elements)
+        
+        # Back cover
+        elements.append(NextPageTemplate('First'))
+        elements.append(PageBreak())
+        back_image = print_ready_image("backemma.png")
+        if back_image:
+            img = Image(back_image, width=letter[0], height=letter[1])
+            elements.append(img)
+        
+        return elements
+
+def generate_pdf(esg_data, personal_info):
+    """Build the report PDF and return it as a BytesIO buffer"""
+    return _report_builder(esg_data).build(personal_info)
+
+# Report bundles: many reports as one PDF or as a ZIP of PDFs, e.g. for all
+# subsidiaries of a group. The one PDF embeds the cover images, logos and
+# fonts once for all reports, but is laid out serially on a single canvas.
+# Only the ZIP builds its PDFs in a process pool of ESG_BUNDLE_WORKERS
+# processes (default: one per CPU).
+BUNDLE_WORKERS = int(os.environ.get("ESG_BUNDLE_WORKERS", os.cpu_count() or 1))
+
+class ReportStart(Flowable):
+    """Zero-size marker on a report's cover page that restarts the page numbering"""
+    _ZEROSIZE = 1
+
+    def wrap(self, availWidth, availHeight):
+        return 0, 0
+
+    def draw(self):
+        self.canv.start_report()
+
+def _report_builder(esg_data):
+    builder = ReportBuilder()
+    for _, key in PDF_SECTIONS:
+        builder.add_section(key, esg_data[key])
+    return builder
+
+def _build_report_pdf(report):
+    esg_data, personal_info = report
+    return generate_pdf(esg_data, personal_info).getvalue()
+
+def _map_reports(fn, reports, workers):
+    """fn applied to every report, in a process pool when there are several workers"""
+    workers = min(workers, len(reports))
+    if workers <= 1:
+        return [fn(report) for report in reports]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, reports))
+
+def generate_pdf_bundle(reports):
+    """Build one PDF of several reports and return it as a BytesIO buffer.
+
+    reports is a list of (esg_data, personal_info) pairs. Every report keeps
+    its own cover, table of contents and "Page X of Y" numbering. The bundle
+    is laid out on a single canvas, so shared images and fonts are written once.
+
+    The build is serial and takes about as long as building every report on
+    its own; it uses one CPU however many there are. generate_pdf_zip builds
+    the reports in parallel.
+    """
+    elements = []
+    for esg_data, personal_info in reports:
+        if elements:
+            elements.append(NextPageTemplate('First'))
+            elements.append(PageBreak())
+        elements.append(ReportStart())
+        elements.extend(_report_builder(esg_data).story(personal_info))
+
+    buffer = io.BytesIO()
+    doc = create_pdf_doc(buffer)
+    doc.build(elements, canvasmaker=NumberedCanvas)
+    buffer.seek(0)
+    return buffer
+
+def generate_pdf_zip(reports, names, workers=BUNDLE_WORKERS):
+    """Build every report as its own PDF and return a ZIP of them as a BytesIO buffer.
+
+    reports is a list of (esg_data, personal_info) pairs and names the file
+    name of each PDF in the archive. The PDFs are built in parallel worker
+    processes.
+    """
+    buffer = io.BytesIO()
+    # PDF streams are already compressed
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, pdf in zip(names, _map_reports(_build_report_pdf, list(reports), workers)):
+            archive.writestr(name, pdf)
+    buffer.seek(0)
+    return buffer
+
+# Built report PDFs are kept on disk keyed by a hash of their content, so a
+# report is laid out once however often the page reruns and however many
+# sessions or jobs ask for it. The least recently used files are removed once
+# the cache grows past ESG_PDF_CACHE_MAX_MB.
+PDF_CACHE_DIR = os.path.join(CACHE_DIR, "pdf")
+PDF_CACHE_MAX_BYTES = int(os.environ.get("ESG_PDF_CACHE_MAX_MB", 500)) * 1024 * 1024
+PDF_LAYOUT_VERSION = 1  # Part of the cache key; bump when the PDF layout changes
+
+def report_pdf_key(esg_data, personal_info):
+    """Cache key of the PDF built from esg_data and personal_info"""
+    payload = json.dumps([PDF_LAYOUT_VERSION, esg_data, personal_info], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def cached_report_pdf(key):
+    """Path of the cached PDF for key, or None; a hit marks the file as recently used"""
+    path = os.path.join(PDF_CACHE_DIR, f"{key}.pdf")
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+def store_report_pdf(key, data):
+    """Add a built PDF to the cache, evicting old ones if needed, and return its path"""
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    path = os.path.join(PDF_CACHE_DIR, f"{key}.pdf")
+    # Written to a temporary file first so readers never see a partial PDF
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    files = []
+    with os.scandir(PDF_CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.name.endswith('.pdf') and entry.path != path:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = len(data) + sum(size for _, size, _ in files)
+    for _, size, old_path in sorted(files):
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(old_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return path
+
+def report_pdf(esg_data, personal_info):
+    """The report PDF as bytes, from the cache or built and added to it"""
+    key = report_pdf_key(esg_data, personal_info)
+    path = cached_report_pdf(key)
+    if path is not None:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass  # Evicted in the meantime
+    data = generate_pdf(esg_data, personal_info).getvalue()
+    store_report_pdf(key, data)
+    return data
+
+def create_disclaimer_page(styles, elements):
+    """Create a single-page disclaimer using Lato font family"""
+    
+    # Lato fonts if available, Helvetica otherwise
+    fonts = load_pdf_assets()['fonts']
+    base_font = fonts['base']
+    bold_font = fonts['bold']
+    
+    # Define custom styles for the disclaimer page with Lato
+    disclaimer_styles = {
+        'title': ParagraphStyle(
+            'DisclaimerTitle',
+            parent=styles['normal'],
+            fontSize=24,
+            fontName=bold_font,
+            leading=28,
+            spaceBefore=0,
+            spaceAfter=10,
+        ),
+        'section_header': ParagraphStyle(
+            'SectionHeader',
+            parent=styles['normal'],
+            fontSize=10,
+            fontName=bold_font,
+            leading=13,
+            spaceBefore=2,
+            spaceAfter=3,
+        ),
+        'body_text': ParagraphStyle(
+            'BodyText',
+            parent=styles['normal'],
+            fontSize=8,
+            fontName=base_font,
+            leading=10,
+            spaceBefore=1,
+            spaceAfter=3,
+            alignment=TA_JUSTIFY,
+        ),
+        'item_header': ParagraphStyle(
+            'ItemHeader',
+            parent=styles['normal'],
+            fontSize=8,
+            fontName=bold_font,
+            leading=11,
+            spaceBefore=4,
+            spaceAfter=1,
+        ),
+        'confidential': ParagraphStyle(
+            'Confidential',
+            parent=styles['normal'],
+            fontSize=8,
+            fontName=base_font,
+            textColor=colors.black,
+            alignment=TA_CENTER,
+            spaceBefore=1,
+        )
+    }    
+    # Main Content
+    elements.append(Paragraph("Limitations of AI in Financial and Strategic Evaluations", 
+                            disclaimer_styles['section_header']))
+
+    # AI Limitations Section
+    limitations = [
+        ("1. Data Dependency and Quality",
+         "AI models rely heavily on the quality and completeness of the data fed into them. The accuracy of the analysis is contingent upon the integrity of the input data. Inaccurate, outdated, or incomplete data can lead to erroneous conclusions and recommendations. Users should ensure that the data used in AI evaluations is accurate and up-to-date."),
+        
+        ("2. Algorithmic Bias and Limitations",
+         "AI algorithms are designed based on historical data and predefined models. They may inadvertently incorporate biases present in the data, leading to skewed results. Additionally, AI models might not fully capture the complexity and nuances of human behavior or unexpected market changes, potentially impacting the reliability of the analysis."),
+        
+        ("3. Predictive Limitations",
+         "While AI can identify patterns and trends, it cannot predict future events with certainty. Financial markets and business environments are influenced by numerous unpredictable factors such as geopolitical events, economic fluctuations, and technological advancements. AI's predictions are probabilistic and should not be construed as definitive forecasts."),
+        
+        ("4. Interpretation of Results",
+         "AI-generated reports and analyses require careful interpretation. The insights provided by AI tools are based on algorithms and statistical models, which may not always align with real-world scenarios. It is essential to involve human expertise in interpreting AI outputs and making informed decisions."),
+        
+        ("5. Compliance and Regulatory Considerations",
+         "The use of AI in financial evaluations and business strategy formulation must comply with relevant regulations and standards. Users should be aware of legal and regulatory requirements applicable to AI applications in their jurisdiction and ensure that their use of AI tools aligns with these requirements.")
+    ]
+
+    for title, content in limitations:
+        elements.append(Paragraph(title, disclaimer_styles['item_header']))
+        elements.append(Paragraph(content, disclaimer_styles['body_text']))
+
+    # RAA Capital Partners Section
+    elements.append(Paragraph("RAA Capital Partners Sdn Bhd and Advisory Partners' Disclaimer",
+                            disclaimer_styles['section_header']))
+
+    elements.append(Paragraph(
+        "RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners provide AI-generated reports and insights as a tool to assist in financial and business strategy evaluations. However, the use of these AI-generated analyses is subject to the following disclaimers:",
+        disclaimer_styles['body_text']
+    ))
+
+    disclaimers = [
+        ("1. No Guarantee of Accuracy or Completeness",
+         "While RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners strive to ensure that the AI-generated reports and insights are accurate and reliable, we do not guarantee the completeness or accuracy of the information provided. The insights are based on the data and models used, which may not fully account for all relevant factors or changes in the market."),
+        
+        ("2. Not Financial or Professional Advice",
+         "The AI-generated reports and insights are not intended as financial, investment, legal, or professional advice. Users should consult with qualified professionals before making any financial or strategic decisions based on AI-generated reports. RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners are not responsible for any decisions made based on the reports provided."),
+        
+        ("3. Limitation of Liability",
+         "RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners shall not be liable for any loss or damage arising from the use of AI-generated reports and insights. This includes, but is not limited to, any direct, indirect, incidental, or consequential damages resulting from reliance on the reports or decisions made based on them."),
+        
+        ("4. No Endorsement of Third-Party Tools",
+         "The use of third-party tools and data sources in AI evaluations is at the user's discretion. RAA Capital Partners Sdn Bhd, Centre for AI Innovation (CEAI) and its advisory partners do not endorse or guarantee the performance or accuracy of any third-party tools or data sources used in conjunction with the AI-generated reports.")
+    ]
+
+    for title, content in disclaimers:
+        elements.append(Paragraph(title, disclaimer_styles['item_header']))
+        elements.append(Paragraph(content, disclaimer_styles['body_text']))
+
+    # Add bottom line
+    elements.append(Table(
+        [['']],
+        colWidths=[7.5*inch],
+        style=TableStyle([
+            ('LINEABOVE', (0,0), (-1,0), 1, colors.black),
+        ])
+    ))
+
+    # Add "strictly confidential"
+    elements.append(Paragraph("strictly confidential", disclaimer_styles['confidential']))
+def create_highlight_box(text, styles):
+    """Create highlighted box with consistent styling"""
+    return Table(
+        [[LayoutCachedParagraph(f"• {text}", styles['content'])]],
+        colWidths=[6*inch],
+        style=TableStyle([
+            ('BACKGROUND', (0,0), (-1,-1), colors.HexColor('#F7FAFC')),
+            ('BORDER', (0,0), (-1,-1), 1, colors.HexColor('#90CDF4')),
+            ('PADDING', (0,0), (-1,-1), 12),
+            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+        ])
+    )
+def create_second_page(styles, org_info):
+    """Create an enhanced front page with modern design elements"""
+    elements = []
+    
+    # Add some space at the top
+    elements.append(Spacer(1, 1*inch))
+    
+    # Create a colored banner for the title
+    title_table = Table(
+        [[Paragraph("Profile Analysis", styles['title'])]],
+        colWidths=[7*inch],
+        style=TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#F0F9FF')),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('TOPPADDING', (0, 0), (-1, -1), 30),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 30),
+            ('LEFTPADDING', (0, 0), (-1, -1), 20),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 20),
+            ('LINEABOVE', (0, 0), (-1, 0), 2, colors.HexColor('#2B6CB0')),
+            ('LINEBELOW', (0, 0), (-1, 0), 2, colors.HexColor('#2B6CB0')),
+        ])
+    )
+    elements.append(title_table)
+    
+    # Add space before organization info
+    elements.append(Spacer(1, 1*inch))
+    
+    # Create a styled box for organization info
+    org_info_content = [
+        [Paragraph("Organization Profile", styles['subheading'])],
+        [Table(
+            [
+                [
+                    Paragraph("Organization Type", 
+                             ParagraphStyle('Label', parent=styles['content'], textColor=colors.HexColor('#2B6CB0'), fontSize=12)),
+                    Paragraph(str(org_info.get('type', 'N/A')), styles['content'])
+                ],
+                [
+                    Paragraph("Industry Sector",
+                             ParagraphStyle('Label', parent=styles['content'], textColor=colors.HexColor('#2B6CB0'), fontSize=12)),
+                    Paragraph(str(org_info.get('sector', 'N/A')), styles['content'])  # Make sure we're using 'sector' here
+                ],
+                [
+                    Paragraph("Report Date",
+                             ParagraphStyle('Label', parent=styles['content'], textColor=colors.HexColor('#2B6CB0'), fontSize=12)),
+                    Paragraph(str(org_info.get('date', 'N/A')), styles['content'])
+                ]
+            ],
+            colWidths=[2*inch, 4*inch],
+            style=TableStyle([
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E2E8F0')),
+                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F7FAFC')),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                ('TOPPADDING', (0, 0), (-1, -1), 12),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+                ('LEFTPADDING', (0, 0), (-1, -1), 15),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 15),
+            ])
+        )]
+    ]
+    
+    info_table = Table(
+        org_info_content,
+        colWidths=[7*inch],
+        style=TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
+            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#90CDF4')),
+            ('TOPPADDING', (0, 0), (-1, -1), 20),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 20),
+            ('LEFTPADDING', (0, 0), (-1, -1), 30),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 30),
+        ])
+    )
+    elements.append(info_table)
+    
+    # Add decorative footer
+    elements.append(Spacer(1, 1*inch))
+    footer_text = ParagraphStyle(
+        'Footer',
+        parent=styles['content'],
+        alignment=TA_CENTER,
+        textColor=colors.HexColor('#4A5568'),
+        fontSize=9
+    )
+    elements.append(Paragraph(
+        "Prepared by Centre for AI Innovation (CEAI)",
+        footer_text
+    ))
+    elements.append(Paragraph(
+        f"Generated on {org_info.get('date', 'N/A')}",
+        footer_text
+    ))
+    
+    return elements
+def create_custom_styles():
+    base_styles = getSampleStyleSheet()
+    
+    fonts = load_pdf_assets()['fonts']
+    base_font = fonts['base']
+    bold_font = fonts['bold']
+
+    styles = {
+        'Normal': base_styles['Normal'],
+        'TOCEntry': ParagraphStyle(
+            'TOCEntry',
+            parent=base_styles['Normal'],
+            fontSize=12,
+            leading=16,
+            leftIndent=20,
+            fontName=base_font
+        ),
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=base_styles['Normal'],
+            fontSize=24,
+            textColor=colors.HexColor('#2B6CB0'),
+            alignment=TA_CENTER,
+            spaceAfter=30,
+            fontName=bold_font,
+            leading=28.8
+        ),
+        'heading': ParagraphStyle(
+            'CustomHeading',
+            parent=base_styles['Normal'],
+            fontSize=26,
+            textColor=colors.HexColor('#1a1a1a'),
+            spaceBefore=20,
+            spaceAfter=15,
+            fontName=bold_font,
+            leading=40.5,
+            tracking=0
+        ),
+        'subheading': ParagraphStyle(
+            'CustomSubheading',
+            parent=base_styles['Normal'],
+            fontSize=12,
+            textColor=colors.HexColor('#4A5568'),
+            spaceBefore=15,
+            spaceAfter=10,
+            fontName=bold_font,
+            leading=18.2
+        ),
+        'normal': ParagraphStyle(
+            'CustomNormal',
+            parent=base_styles['Normal'],
+            fontSize=10,
+            textColor=colors.HexColor('#1a1a1a'),
+            spaceBefore=6,
+            spaceAfter=6,
+            fontName=base_font,
+            leading=15.4,
+            tracking=0
+        ),
+        'content': ParagraphStyle(
+            'CustomContent',
+            parent=base_styles['Normal'],
+            fontSize=10,
+            textColor=colors.HexColor('#1a1a1a'),
+            alignment=TA_JUSTIFY,
+            spaceBefore=6,
+            spaceAfter=6,
+            fontName=base_font,
+            leading=15.4,
+            tracking=0
+        ),
+        'bullet': ParagraphStyle(
+            'CustomBullet',
+            parent=base_styles['Normal'],
+            fontSize=10,
+            textColor=colors.HexColor('#1a1a1a'),
+            leftIndent=20,
+            firstLineIndent=0,
+            fontName=base_font,
+            leading=15.4,
+            tracking=0
+        )
+    }
+    
+    return styles
+def scale_image_to_fit(image_path, max_width, max_height):
+    """Scale image to fit within maximum dimensions while maintaining aspect ratio."""
+    from PIL import Image as PILImage
+    import os
+    
+    if not os.path.exists(image_path):
+        return None
+        
+    try:
+        img = PILImage.open(image_path)
+        img_width, img_height = img.size
+        
+        # Calculate scaling factor
+        width_ratio = max_width / img_width
+        height_ratio = max_height / img_height
+        scale = min(width_ratio, height_ratio)
+        
+        new_width = img_width * scale
+        new_height = img_height * scale
+        
+        return new_width, new_height
+    except Exception as e:
+        print(f"Error scaling image: {str(e)}")
+        return None
+
+# Full-page cover images are downscaled to print resolution once and cached
+# on disk; a new variant is made whenever the source file changes.
+PRINT_IMAGE_DPI = int(os.environ.get("ESG_PRINT_IMAGE_DPI", 150))
+PRINT_IMAGE_JPEG_QUALITY = 85
+
+def print_ready_image(image_path, width=letter[0], height=letter[1], dpi=PRINT_IMAGE_DPI):
+    """Return the path of a cached print-resolution variant of image_path.
+
+    `width` and `height` are the printed size in points. Opaque images are
+    stored as JPEG, images with transparency as PNG. Returns None if the
+    source image does not exist.
+    """
+    from PIL import Image as PILImage
+
+    if not os.path.exists(image_path):
+        return None
+
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    variant_key = f"{stem}-{int(os.path.getmtime(image_path))}-{dpi}-{int(width)}x{int(height)}"
+    asset_dir = os.path.join(CACHE_DIR, "assets")
+    for ext in (".jpg", ".png"):
+        variant_path = os.path.join(asset_dir, variant_key + ext)
+        if os.path.exists(variant_path):
+            return variant_path
+
+    size = scale_image_to_fit(image_path, width / 72 * dpi, height / 72 * dpi)
+    if size is None:
+        return image_path
+    try:
+        img = PILImage.open(image_path)
+        if size[0] < img.size[0]:
+            img = img.resize((round(size[0]), round(size[1])), PILImage.LANCZOS)
+
+        has_alpha = img.mode in ('RGBA', 'LA', 'P') and img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+        os.makedirs(asset_dir, exist_ok=True)
+        variant_path = os.path.join(asset_dir, variant_key + (".png" if has_alpha else ".jpg"))
+        tmp_path = f"{variant_path}.{os.getpid()}.{threading.get_ident()}.part"
+        if has_alpha:
+            img.save(tmp_path, "PNG", optimize=True)
+        else:
+            img.convert('RGB').save(tmp_path, "JPEG", quality=PRINT_IMAGE_JPEG_QUALITY, optimize=True)
+        os.replace(tmp_path, variant_path)
+        return variant_path
+    except Exception as e:
+        print(f"Error preparing print image: {str(e)}")
+        return image_path
+
+def create_front_page(styles, org_info):
+    """Create a front page using a full-page cover image."""
+    elements = []
+    
+    if os.path.exists("frontemma.png"):
+        # Create full page image without margins
+        img = Image(
+            "frontemma.png",
+            width=letter[0],     # Full letter width (8.5 inches)
+            height=letter[1]     # Full letter height (11 inches)
+        )
+        elements.append(img)
+    else:
+        # Fallback content if image is missing
+        elements.extend([
+            Spacer(1, 2*inch),
+            Paragraph("ESG Assessment Report", styles['title']),
+            Spacer(1, 1*inch),
+            Paragraph(f"Organization: {org_info['organization_name']}", styles['content']),
+            Paragraph(f"Date: {org_info['date']}", styles['content'])
+        ])
+    
+    return elements
+
+
+# Markdown conversion for LLM output. Each line is classified by one
+# precompiled pattern and its inline markup converted by another, in a
+# single pass over the text.
+_MD_LINE_RE = re.compile(
+    r'#{1,6}\s*(?P<heading>.*?)\s*#*$'
+    r'|\*\*(?P<bold_heading>[^*]+)\*\*:?$'
+    r'|(?P<rule>[-*_]{3,})$'
+    r'|\d+\.?\s+(?P<point>.+)'
+    r'|(?:•|[*+-](?=\s))\s*(?P<bullet>.*)'
+)
+_MD_INLINE_RE = re.compile(
+    # The lookahead lets the scan skip ordinary characters cheaply
+    r'(?=[*_`.])(?:'
+    r'\*\*(?P<bold>.+?)\*\*|__(?P<bold2>.+?)__'
+    r'|(?<![\w*])\*(?P<italic>[^*\s](?:[^*]*[^*\s])?)\*(?!\w)'
+    r'|(?<![\w_])_(?P<italic2>[^_\s](?:[^_]*[^_\s])?)_(?!\w)'
+    r'|`(?P<code>[^`]*)`'
+    r'|(?P<stray>[*`]+)'
+    r'|(?P<dots>\.{2,})'
+    r')'
+)
+# Lines containing these are shown as subheadings wherever they appear
+MD_SUBHEADING_PHRASES = ("Summary", "Strengths and Advantages", "Skills and Competencies")
+MD_NEW_PAGE_PHRASE = "Compatible Personality and Behavioral Insights"  # also starts a new page
+
+def _inline_markup(text):
+    """Convert inline markdown to ReportLab paragraph markup, escaping XML characters"""
+    text = escape(text)
+    if '*' in text or '_' in text or '`' in text or '..' in text:
+        text = _MD_INLINE_RE.sub(_inline_replacement, text)
+    return text
+
+def _inline_replacement(match):
+    group = match.lastgroup
+    if group in ('bold', 'bold2'):
+        return f"<b>{_MD_INLINE_RE.sub(_inline_replacement, match.group(group))}</b>"
+    if group in ('italic', 'italic2'):
+        return f"<i>{match.group(group)}</i>"
+    if group == 'code':
+        return match.group('code')
+    if group == 'dots':
+        return '.'
+    return ''
+
+def parse_markdown(content):
+    """Yield (kind, markup) for each line of LLM markdown.
+
+    kind is 'heading', 'new_page_heading', 'point', 'bullet' or 'paragraph';
+    markup is the line's text as ReportLab paragraph markup.
+    """
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = _MD_LINE_RE.match(line)
+        kind = match.lastgroup if match else 'paragraph'
+        if kind == 'rule':
+            continue
+        text = _inline_markup(match.group(kind) if match else line)
+        if not text:
+            continue
+        if MD_NEW_PAGE_PHRASE in line:
+            kind = 'new_page_heading'
+        elif kind == 'bold_heading' or any(phrase in line for phrase in MD_SUBHEADING_PHRASES):
+            kind = 'heading'
+        yield kind, text
+
+def markdown_flowables(content, styles):
+    """Yield ReportLab flowables for LLM markdown: headings, numbered points, bullets and paragraphs
+
+    content may also be a list of (kind, text) blocks, as made from a
+    structured (JSON mode) result, which are laid out without parsing.
+    """
+    if isinstance(content, str):
+        blocks = parse_markdown(content)
+    else:
+        blocks = ((kind, _inline_markup(text)) for kind, text in content)
+    for kind, text in blocks:
+        if kind == 'heading':
+            yield LayoutCachedParagraph(text, styles['subheading'])
+        elif kind == 'new_page_heading':
+            yield PageBreak()
+            yield LayoutCachedParagraph(text, styles['subheading'])
+        elif kind == 'point':
+            yield Spacer(1, 0.1*inch)
+            yield create_highlight_box(text, styles)
+            yield Spacer(1, 0.1*inch)
+        elif kind == 'bullet':
+            yield LayoutCachedParagraph(f"• {text}", styles['bullet'])
+        else:
+            yield LayoutCachedParagraph(text, styles['content'])
+            yield Spacer(1, 0.05*inch)
+
+def process_content(content, styles, elements):
+    """Process content with proper formatting"""
+    if content:
+        elements.extend(markdown_flowables(content, styles))
+def create_header_footer(canvas, doc):
+    """Add header and footer with smaller, transparent images in the top right and a line below the header."""
+    canvas.saveState()
+    
+    # Fonts and logos are loaded once per process by the asset registry
+    assets = load_pdf_assets()
+    base_font = assets['fonts']['base']
+    bold_font = assets['fonts']['bold']
+    
+    if doc.page > 1:  # Only show on pages after the first page
+        # Adjust the position to the top right
+        x_start = doc.width + doc.leftMargin - 1.0 * inch  # Align closer to the right
+        y_position = doc.height + doc.topMargin - 0.1 * inch  # Slightly below the top margin
+        image_width = 0.5 * inch  # Smaller width
+        image_height = 0.5 * inch  # Smaller height
+
+        # Draw images (ensure they are saved with transparent backgrounds)
+        if "ceai.png" in assets['logos']:
+            canvas.drawImage(
+                assets['logos']["ceai.png"],
+                x_start, 
+                y_position, 
+                width=image_width, 
+                height=image_height, 
+                mask="auto"
+            )
+        
+        if "raa.png" in assets['logos']:
+            canvas.drawImage(
+                assets['logos']["raa.png"],
+                x_start - image_width - 0.1 * inch,
+                y_position, 
+                width=image_width, 
+                height=image_height, 
+                mask="auto"
+            )
+        
+        if "emma.png" in assets['logos']:
+            canvas.drawImage(
+                assets['logos']["emma.png"],
+                x_start - 2 * (image_width + 0.1 * inch),
+                y_position, 
+                width=image_width, 
+                height=image_height, 
+                mask="auto"
+            )
+        
+        # Add Header Text using Lato Bold
+        canvas.setFont(bold_font, 24)
+        canvas.drawString(doc.leftMargin, doc.height + doc.topMargin - 0.1*inch, 
+                         "ESG Starter's Kit")
+
+        # Draw line below the header text
+        line_y_position = doc.height + doc.topMargin - 0.30 * inch
+        canvas.setLineWidth(0.5)
+        canvas.line(doc.leftMargin, line_y_position, doc.width + doc.rightMargin, line_y_position)
+
+        # Footer using regular Lato
+        canvas.setFont(base_font, 9)
+        canvas.drawString(doc.leftMargin, 0.5 * inch, 
+                          f"Generated on {datetime.datetime.now().strftime('%B %d, %Y')}")
+        canvas.draw_page_number(doc.width + doc.rightMargin, 0.5 * inch)
+    canvas.restoreState()
+def create_header_footer_disclaimer(canvas, doc):
+    """Add header and footer with smaller, transparent images in the top right and a line below the header."""
+    canvas.saveState()
+    
+    # Fonts and logos are loaded once per process by the asset registry
+    assets = load_pdf_assets()
+    base_font = assets['fonts']['base']
+    bold_font = assets['fonts']['bold']
+    
+    if doc.page > 1:  # Only show on pages after the first page
+        # Adjust the position to the top right
+        x_start = doc.width + doc.leftMargin - 1.0 * inch  # Align closer to the right
+        y_position = doc.height + doc.topMargin - 0.1 * inch  # Slightly below the top margin
+        image_width = 0.5 * inch  # Smaller width
+        image_height = 0.5 * inch  # Smaller height
+
+        # Draw images (ensure they are saved with transparent backgrounds)
+        if "ceai.png" in assets['logos']:
+            canvas.drawImage(
+                assets['logos']["ceai.png"],
+                x_start, 
+                y_position, 
+                width=image_width, 
+                height=image_height, 
+                mask="auto"
+            )
+        
+        if "raa.png" in assets['logos']:
+            canvas.drawImage(
+                assets['logos']["raa.png"],
+                x_start - image_width - 0.1 * inch,
+                y_position, 
+                width=image_width, 
+                height=image_height, 
+                mask="auto"
+            )
+        
+        if "emma.png" in assets['logos']:
+            canvas.drawImage(
+                assets['logos']["emma.png"],
+                x_start - 2 * (image_width + 0.1 * inch),
+                y_position, 
+                width=image_width, 
+                height=image_height, 
+                mask="auto"
+            )
+        
+        # Add Header Text - Fixed by properly setting font name and size
+        canvas.setFont(bold_font, 27)  # Set font with name and size
+        canvas.drawString(doc.leftMargin, doc.height + doc.topMargin - 0.1*inch, 
+                         "Disclaimer")
+
+        # Draw line below the header text
+        line_y_position = doc.height + doc.topMargin - 0.30 * inch
+        canvas.setLineWidth(0.5)
+        canvas.line(doc.leftMargin, line_y_position, doc.width + doc.rightMargin, line_y_position)
+
+        # Footer - Fixed by properly setting font name and size
+        canvas.setFont(base_font, 9)  # Set font with name and size
+        canvas.drawString(doc.leftMargin, 0.5 * inch, 
+                         f"Generated on {datetime.datetime.now().strftime('%B %d, %Y')}")
+        canvas.draw_page_number(doc.width + doc.rightMargin, 0.5 * inch)
+    
+    canvas.restoreState()
@@ -0,0 +1,77 @@
+"""Offline generation of the framework analysis baselines.
+
+Generates a generic framework analysis for every combination of industry
+(FIELDS_OF_INDUSTRY) and organization type (ORGANIZATION_TYPES) and stores
+it in CACHE_DIR/baselines.sqlite. The app then builds the framework
+analysis of a matching organization from its baselines plus a short
+personalization. Combinations that already have a baseline are skipped
+unless --refresh is given, so a nightly run with --refresh renews the
+whole grid.
+
+Usage:
+    python precompute_baselines.py --concurrency 4
+    python precompute_baselines.py --refresh --industry Insurance
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from EsgStarterkitV2 import (
+    FIELDS_OF_INDUSTRY, ORGANIZATION_TYPES, generate_baseline, get_baselines
+)
+
+
+def run_precompute(api_key, industries, org_types, concurrency=4, refresh=False):
+    """Generate the missing (or with refresh, all) baselines.
+
+    Returns a list of ((industry, organization type), error message) for the
+    combinations that failed.
+    """
+    todo = []
+    for industry in industries:
+        existing = {} if refresh else get_baselines(industry, org_types)
+        todo.extend((industry, org_type) for org_type in org_types if org_type not in existing)
+    print(f"{len(todo)} of {len(industries) * len(org_types)} baselines to generate")
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(generate_baseline, industry, org_type, api_key, refresh): (industry, org_type)
+            for industry, org_type in todo
+        }
+        for future in as_completed(futures):
+            combination = futures[future]
+            try:
+                future.result()
+                print(f"[{' / '.join(combination)}] done")
+            except Exception as e:
+                failures.append((combination, str(e)))
+                print(f"[{' / '.join(combination)}] failed: {e}", file=sys.stderr)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the framework analysis baselines")
+    parser.add_argument("--industry", action="append", choices=FIELDS_OF_INDUSTRY,
+                        help="Only this industry (may be repeated)")
+    parser.add_argument("--organization-type", action="append", choices=ORGANIZATION_TYPES,
+                        help="Only this organization type (may be repeated)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Regenerate baselines that already exist")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Number of baselines generated at the same time")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="OpenAI API key (defaults to $OPENAI_API_KEY)")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("an OpenAI API key is required (--api-key or $OPENAI_API_KEY)")
+
+    industries = args.industry or FIELDS_OF_INDUSTRY
+    org_types = args.organization_type or ORGANIZATION_TYPES
+    failures = run_precompute(args.api_key, industries, org_types, args.concurrency, args.refresh)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())